@@ -7,13 +7,25 @@
 # This plugin for Zim allows to make quick notes from PDF files.
 #
 
+import imp
+
+from distutils.spawn import find_executable
+
 from zim.plugins import PluginClass
 from zim.gui.widgets import RIGHT_PANE, PANE_POSITIONS
 
-from .gui import MainWindowExtension, get_keys
+# poppler is imported by the model with the first document and
+# the widget with gtk, cairo and the rest with the first window
+from .extension import MainWindowExtension, get_keys
 
-# depends on python-poppler package
-import poppler
+def has_module(name):
+    
+    # find the module without importing it
+    try:
+        imp.find_module(name)
+        return True
+    except ImportError:
+        return False
 
 def check_keys(value, default):
     
@@ -45,23 +57,27 @@ class PDFNotesPlugin(PluginClass):
         ( 'image_width', 'int', _('Max image width in px'), 1024, (1, 10000)),
         ( 'image_height', 'int', _('Max image height in px'), 1024, (1, 10000)),
         ( 'switch_mode', 'string', _('Shortcut for switching selecting modes'), 'Control_R', check_keys),
+        ( 'render_process', 'bool', _('Render pages in separate processes'), False),
+        ( 'ocr', 'bool', _('Recognize text of scanned pages with Tesseract'), True),
+        ( 'annotation_images', 'bool', _('Insert images of areas of imported annotations'), False),
+        ( 'source_links', 'bool', _('Insert links to the source in PDF'), True),
     )
-# 
-#     @classmethod
-#     def check_dependencies(klass):
-#         # TODO
-#         '''Checks what dependencies are met and gives details
-# 
-#         @returns: a boolean telling overall dependencies are met,
-#         followed by a list with details.
-# 
-#         This list consists of 3-tuples consisting of a (short)
-#         description of the dependency, a boolean for dependency being
-#         met, and a boolean for this dependency being optional or not.
-# 
-#         @implementation: must be implemented in sub-classes that have
-#         one or more (external) dependencies.
-#         '''
-#         return (True, [])
+
+    @classmethod
+    def check_dependencies(klass):
+        '''Checks what dependencies are met and gives details
+
+        @returns: a boolean telling overall dependencies are met,
+        followed by a list with details.
+        '''
+        poppler = has_module('poppler')
+        numpy = has_module('numpy')
+        tesseract = find_executable('tesseract') != None
+        pdftoppm = find_executable('pdftoppm') != None
+        
+        return poppler, [('python-poppler', poppler, False),
+                         ('python-numpy', numpy, True),
+                         ('tesseract', tesseract, True),
+                         ('pdftoppm', pdftoppm, True)]
         
 # end of file __init__.py
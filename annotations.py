@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+
+# Author: Vendula Poncova <poncovka@gmail.com>
+# File: annotations.py
+#
+# Description:
+# Zim page with annotations of PDF document.
+#
+
+import re
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# annotations which mark text
+TEXT_ANNOTS = ('highlight', 'underline', 'squiggly', 'strike-out')
+
+# labels of annotation types
+ANNOT_LABELS = {
+    'highlight'  : _('Highlight'),
+    'underline'  : _('Underline'),
+    'squiggly'   : _('Squiggly'),
+    'strike-out' : _('Strike out'),
+    'text'       : _('Note'),
+    'free-text'  : _('Text'),
+}
+
+def get_page_name(title):
+
+    # characters not allowed in names of Zim pages
+    name = u' '.join(re.sub(r'[^\w\s\-\.]+', ' ', title, flags=re.UNICODE).split())
+    return (name or _('PDF')) + ' ' + _('annotations')
+
+def format_text(text):
+
+    # one line without wiki markup
+    text = u' '.join(text.split())
+    return re.sub(r'(\*\*|//|__|~~|\'\'|\[\[|\{\{)', lambda m: m.group(0)[0] + u' ' + m.group(0)[1], text)
+
+def format_annotation(kind, text, contents, author, images):
+
+    label = ANNOT_LABELS.get(kind, kind.replace('-', ' ').capitalize())
+    line = u'* **' + label + u'**'
+
+    if author :
+        line += u' (' + format_text(author) + u')'
+
+    if text :
+        line += u': "' + format_text(text) + u'"'
+
+    if contents :
+        line += (u' - ' if text else u': ') + format_text(contents)
+
+    lines = [line]
+
+    # images of annotated areas
+    for src, width in images :
+        lines.append(u'\t* {{%s?width=%i}}' % (src, width))
+
+    return lines
+
+def format_annotations(title, pages):
+    '''
+    Returns text of Zim page in wiki format. Pages are tuples
+    (page number, annotations) and annotations are tuples
+    (kind, text, contents, author, images).
+    '''
+    lines = [u'====== ' + format_text(title) + u' ======',
+             _('Annotations imported %s') % time.strftime('%Y-%m-%d %H:%M'),
+             u'']
+
+    for page_number, annotations in pages :
+
+        lines.append(u'===== ' + _('Page %i') % (page_number + 1) + u' =====')
+
+        for annotation in annotations :
+            lines.extend(format_annotation(*annotation))
+
+        lines.append(u'')
+
+    return u'\n'.join(lines) + u'\n'
+
+# end of file annotations.py
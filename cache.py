@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+
+# Author: Vendula Poncova <poncovka@gmail.com>
+# File: cache.py
+#
+# Description:
+# Files cached by PDF Notes plugin.
+#
+
+import os
+import hashlib
+import logging
+
+from zim.config import XDG_CACHE_HOME
+
+logger = logging.getLogger(__name__)
+
+def get_cache_dir(*names):
+
+    # get path of the directory
+    path = XDG_CACHE_HOME.subdir(('zim', 'pdfnotes') + names).path
+
+    # create dirs if necessary
+    if not os.path.exists(path):
+        os.makedirs(path)
+
+    return path
+
+def get_preview_path(file_path):
+
+    # name the preview by the path of the document
+    name = hashlib.sha1(file_path.encode('utf-8')).hexdigest() + '.png'
+    return os.path.join(get_cache_dir('previews'), name)
+
+def get_ocr_path(file_hash, page_number):
+
+    # recognized text of page of the file with given hash
+    return os.path.join(get_cache_dir('ocr', file_hash), '%i.json' % page_number)
+
+# end of file cache.py
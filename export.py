@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+
+# Author: Vendula Poncova <poncovka@gmail.com>
+# File: export.py
+#
+# Description:
+# Export of rendered parts of PDF pages.
+#
+
+import gtk
+import sys
+import zlib
+import cairo
+import struct
+import logging
+
+from cStringIO import StringIO
+
+from .lazy import LazyModule
+
+logger = logging.getLogger(__name__)
+
+# numpy is optional and imported on the first use
+numpy = LazyModule('numpy')
+
+# positions of red, green and blue in pixels of cairo,
+# which are 32-bit integers in the native byte order
+if sys.byteorder == 'little' :
+    CHANNELS = (2, 1, 0)
+else :
+    CHANNELS = (1, 2, 3)
+
+def surface_to_png(surface):
+
+    # encode surface in memory
+    data = StringIO()
+    surface.write_to_png(data)
+
+    return data.getvalue()
+
+def surface_to_rgb(surface):
+    '''
+    Returns pixels of surface in format RGB24 as rows of RGB bytes.
+    '''
+    width, height = surface.get_width(), surface.get_height()
+    stride = surface.get_stride()
+
+    surface.flush()
+    data = surface.get_data()
+
+    # reorder all channels at once
+    if numpy.is_available() :
+        pixels = numpy.frombuffer(data, dtype=numpy.uint8).reshape(height, stride)[:, :width * 4]
+        return pixels.reshape(height, width, 4)[:, :, list(CHANNELS)].tostring()
+
+    rgb = bytearray(width * 3 * height)
+
+    for y in range(height):
+        pixels = data[y * stride:y * stride + width * 4]
+        row = y * width * 3
+
+        for position, channel in enumerate(CHANNELS):
+            rgb[row + position:row + width * 3:3] = pixels[channel::4]
+
+    return bytes(rgb)
+
+def surface_to_pixbuf(surface):
+
+    # pixels without encoding, the pixbuf copies them
+    return gtk.gdk.pixbuf_new_from_data(surface_to_rgb(surface), gtk.gdk.COLORSPACE_RGB, False, 8,
+                                        surface.get_width(), surface.get_height(), surface.get_width() * 3)
+
+def copy_image_to_clipboard(surface):
+    logger.debug('PDF Notes: copy image to clipboard')
+
+    clipboard = gtk.Clipboard(selection='CLIPBOARD')
+    clipboard.set_image(surface_to_pixbuf(surface))
+
+def copy_text_to_clipboard(text):
+    logger.debug('PDF Notes: copy text to clipboard')
+
+    clipboard = gtk.Clipboard(selection='CLIPBOARD')
+    clipboard.set_text(text)
+
+def table_to_text(rows):
+
+    # cells separated by tabs
+    return u'\n'.join(u'\t'.join(row) for row in rows)
+
+def table_to_wiki(rows):
+
+    # cells of Zim tables are one line without pipes
+    rows = [[u' '.join(cell.replace(u'|', u'\\|').split()) or u' ' for cell in row] for row in rows]
+    lines = [u'|' + u'|'.join(rows[0]) + u'|',
+             u'|' + u'|'.join(u'-' * max(3, len(cell)) for cell in rows[0]) + u'|']
+
+    for row in rows[1:] :
+        lines.append(u'|' + u'|'.join(row) + u'|')
+
+    return u'\n'.join(lines) + u'\n'
+
+def write_png_chunk(f, kind, data):
+
+    f.write(struct.pack('>I', len(data)))
+    f.write(kind)
+    f.write(data)
+    f.write(struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff))
+
+def write_png_in_bands(f, width, height, max_size, render):
+    '''
+    Writes PNG image of given size to file f. The image is rendered by
+    function render(context) in horizontal bands of at most max_size
+    bytes, which are encoded and written immediately.
+    '''
+
+    band_height = max(1, min(height, max_size // (width * 4)))
+    logger.debug('PDF Notes: writing image %sx%s in bands of %s rows', width, height, band_height)
+
+    # header: 8 bits per channel, RGB
+    f.write('\x89PNG\r\n\x1a\n')
+    write_png_chunk(f, 'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+
+    compressor = zlib.compressobj()
+    surface = cairo.ImageSurface(cairo.FORMAT_RGB24, width, band_height)
+    row = bytearray(1 + width * 3)
+
+    for y in range(0, height, band_height):
+
+        rows = min(band_height, height - y)
+
+        # clear band and render it
+        context = cairo.Context(surface)
+        context.set_source_rgb(1, 1, 1)
+        context.paint()
+        context.translate(0, -y)
+        render(context)
+        surface.flush()
+
+        data = surface.get_data()
+        stride = surface.get_stride()
+
+        # encode rows: no filter, channels in RGB order
+        for i in range(rows):
+            pixels = data[i * stride:i * stride + width * 4]
+
+            for position, channel in enumerate(CHANNELS):
+                row[1 + position::3] = pixels[channel::4]
+
+            compressed = compressor.compress(bytes(row))
+
+            if compressed :
+                write_png_chunk(f, 'IDAT', compressed)
+
+    write_png_chunk(f, 'IDAT', compressor.flush())
+    write_png_chunk(f, 'IEND', '')
+
+# end of file export.py
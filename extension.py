@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+
+# Author: Vendula Poncova <poncovka@gmail.com>
+# File: extension.py
+#
+# Description:
+# Extension of main window of Zim, which creates the widget of
+# PDF Notes plugin. The tab is empty until it is shown, then the
+# widget and its modules are imported, so the start of Zim stays
+# cheap.
+#
+
+import gtk
+import gobject
+import logging
+
+from zim.plugins import extends, WindowExtension
+from zim.gui.widgets import WindowSidePaneWidget
+
+from .sources import get_source_id
+
+logger = logging.getLogger(__name__)
+
+def get_keys(value):
+
+    keys = ''.join(value.split()).split('+')
+
+    for key in keys :
+        if gtk.gdk.keyval_from_name(key) == 0 :
+            return False
+
+    return set(keys)
+
+class PlaceholderWidget(gtk.VBox, WindowSidePaneWidget):
+    '''
+    Empty tab, which is replaced by the widget when it is shown.
+    '''
+    def __init__(self):
+        gtk.VBox.__init__(self)
+
+@extends('MainWindow')
+class MainWindowExtension(WindowExtension):
+
+    TAB_NAME = _('Notes from PDF')
+
+    # the reading state and previews are saved
+    keep_state = True
+
+    def __init__(self, plugin, window):
+        # initialize
+        WindowExtension.__init__(self, plugin, window)
+        self.preferences = plugin.preferences
+        self.uistate = plugin.uistate
+
+        # reading state of documents
+        self.uistate.setdefault('last_file', '')
+        self.uistate.setdefault('documents', {})
+
+        # widget initialize
+        self.widget = None
+        self.placeholder = None
+        self.widget_idle = None
+        self.connect_widget()
+
+        # signals
+        self.preferences_state = dict(self.preferences)
+        self.connectto(plugin, 'preferences-changed')
+
+        # links to sources in PDF, if Zim lets us open them
+        self.source_links = bool(gobject.signal_lookup('activate-link', self.window.pageview))
+
+        if self.source_links :
+            self.connectto(self.window.pageview, 'activate-link')
+
+    def connect_widget(self):
+        logger.debug('PDF Notes: connect_widget')
+
+        tab = self.widget or self.placeholder
+
+        # the widget is created when the tab is shown
+        if tab == None :
+            tab = self.placeholder = PlaceholderWidget()
+            self.placeholder.connect('map', self.on_placeholder_map)
+        else:
+            self.window.remove(tab)
+
+        # connect widget as tab
+        self.window.add_tab(self.TAB_NAME, tab, self.preferences['pane_position'])
+        # show widget
+        tab.show_all()
+
+    def on_placeholder_map(self, placeholder):
+
+        # replace the placeholder after the window is drawn
+        if self.widget_idle == None :
+            self.widget_idle = gobject.idle_add(self.on_widget_idle)
+
+    def on_widget_idle(self):
+
+        self.widget_idle = None
+        self.create_widget()
+
+        # do not repeat
+        return False
+
+    def create_widget(self):
+
+        # already created
+        if self.widget != None :
+            return self.widget
+
+        logger.debug('PDF Notes: create_widget')
+
+        # the widget imports cairo, gio and the rest
+        from .gui import PDFNotesWidget
+
+        self.widget = PDFNotesWidget(self,
+                                     self.window.ui,
+                                     self.preferences)
+
+        # replace the placeholder
+        if self.placeholder != None :
+            self.window.remove(self.placeholder)
+            self.placeholder.destroy()
+            self.placeholder = None
+
+        self.window.add_tab(self.TAB_NAME, self.widget, self.preferences['pane_position'])
+        self.widget.show_all()
+
+        return self.widget
+
+    def disconnect_widget(self):
+        logger.debug('PDF Notes: disconnect_widget')
+
+        if self.widget_idle != None :
+            gobject.source_remove(self.widget_idle)
+            self.widget_idle = None
+
+        for tab in (self.widget, self.placeholder) :
+            if tab != None :
+                self.window.remove(tab)
+                tab.destroy()
+
+        self.widget = None
+        self.placeholder = None
+
+    def on_preferences_changed(self, plugin):
+        logger.debug('PDF Notes: on_preferences_changed')
+
+        # find changed preferences
+        changed = set(key for key in self.preferences
+                      if self.preferences[key] != self.preferences_state.get(key))
+
+        self.preferences_state = dict(self.preferences)
+
+        # move the tab
+        if 'pane_position' in changed :
+            self.connect_widget()
+
+        # apply the rest of preferences in place
+        if self.widget != None :
+            self.widget.on_preferences_changed(changed)
+
+    def on_activate_link(self, pageview, link, hints):
+
+        if isinstance(link, dict) :
+            link = link.get('href')
+
+        source_id = get_source_id(link)
+
+        # not a link to PDF
+        if source_id == None :
+            return False
+
+        self.create_widget().show_source(source_id)
+        return True
+
+    def destroy(self):
+        logger.debug('PDF Notes: destroy')
+
+        self.disconnect_widget()
+        WindowExtension.destroy(self)
+
+# end of file extension.py
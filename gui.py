@@ -13,89 +13,95 @@
 from __future__ import with_statement
 
 import gtk
+import gio
+import gobject
 import logging
 import cairo
 import time
+import math
 import os
 import re
 
-from zim.plugins import extends, WindowExtension
+from collections import OrderedDict
+
 from zim.gui.widgets import WindowSidePaneWidget, ScrolledWindow, InputEntry, IconButton, FileDialog, gtk_combobox_set_active_text
 from zim.gui.pageview import SCROLL_TO_MARK_MARGIN
 from zim.fs import File
+from zim.notebook import Path
 
+from .extension import get_keys
 from .model import PDFDocument
+from .cache import get_preview_path
+from .annotations import format_annotations, get_page_name, TEXT_ANNOTS
+from .sources import SourceIndex, get_index_path, get_link
 
 logger = logging.getLogger(__name__)
 
-def get_keys(value):
-    
-    keys = ''.join(value.split()).split('+')
-    
-    for key in keys :        
-        if gtk.gdk.keyval_from_name(key) == 0 :
-            return False
-        
-    return set(keys)
+# delay in ms before the page is rendered at the final size
+RESIZE_DELAY = 200
 
-@extends('MainWindow')
-class MainWindowExtension(WindowExtension):
+# delay in ms before the page is rendered at the final zoom
+ZOOM_DELAY = 250
 
-    TAB_NAME = _('Notes from PDF')
+# delay in ms before the modified file is reloaded
+RELOAD_DELAY = 500
 
-    def __init__(self, plugin, window):     
-        # initialize
-        WindowExtension.__init__(self, plugin, window)
-        self.preferences = plugin.preferences
-        self.uistate = plugin.uistate
-        
-        # widget initialize
-        self.widget = None
-        self.connect_widget()
-        
-        # signals
-        self.connectto(plugin, 'preferences-changed')
-        
-    def connect_widget(self):  
-        logger.debug('PDF Notes: connect_widget')   
-        
-        # create widget
-        if self.widget == None :    
-            self.widget = PDFNotesWidget(self, 
-                                         self.window.ui,
-                                         self.preferences)
-        else:
-            self.window.remove(self.widget)
-                   
-        # connect widget as tab    
-        self.window.add_tab(self.TAB_NAME, self.widget, self.preferences['pane_position'])        
-        # show widget
-        self.widget.show_all()
-                
-    def disconnect_widget(self):
-        logger.debug('PDF Notes: disconnect_widget')
-        
-        if self.widget != None :
-            self.window.remove(self.widget)
-            self.widget.destroy()
-            self.widget = None
-    
-    def on_preferences_changed(self, plugin):
-        logger.debug('PDF Notes: on_preferences_changed')
-        self.connect_widget()
-            
-    def destroy(self):
-        logger.debug('PDF Notes: destroy')
-        
-        self.disconnect_widget()
-        WindowExtension.destroy(self)
-        
+# idle time in ms after interaction before full quality is drawn
+DRAFT_DELAY = 300
+
+# part of the resolution used for pages rendered during interaction
+DRAFT_RESOLUTION = 0.5
+
+# number of documents with remembered state
+MAX_DOCUMENTS = 20
+
+# max size in bytes of surface for exported images,
+# larger images are rendered in bands
+MAX_SURFACE_SIZE = 16 * 1024 * 1024
+
+# max number of pixels of rendered page, only the visible
+# area of larger pages is rendered
+MAX_RENDER_PIXELS = 4 * 1024 * 1024
+
+# part of the visible size rendered around the visible area
+RENDER_MARGIN = 0.5
+
+# number of pages scanned for annotations at once
+ANNOT_PAGES = 20
+
+# number of rendered pages kept in memory
+MAX_SURFACES = 4
+
+# resolution of display with device scale 1
+BASE_DPI = 96.0
+
+# number of repeated requests to render server before
+# the page is rendered in this process
+RENDER_RETRIES = 1
+
+def get_device_scale():
+    '''
+    Returns the number of device pixels per logical pixel. GTK 2
+    does not scale windows, so the scale is taken from GDK_SCALE
+    or from the resolution of the screen.
+    '''
+    try:
+        return max(1.0, float(os.environ['GDK_SCALE']))
+    except (KeyError, ValueError):
+        pass
+
+    screen = gtk.gdk.screen_get_default()
+    dpi = screen.get_resolution() if screen else -1
+
+    return max(1.0, dpi / BASE_DPI)
 
 class PDFNotesWidget(gtk.VBox, WindowSidePaneWidget):
 
-    SELECT_TEXT  = _('Select paragraph')
+    SELECT_TEXT  = _('Select area of text')
     SELECT_LINE  = _('Select text')
+    SELECT_PARAGRAPH = _('Select paragraph')
     SELECT_IMAGE = _('Select image')
+    SELECT_TABLE = _('Select table')
     ZOOM_SETTING = _('Zoom')
     ZOOM_FIT     = _('Fit width')
 
@@ -119,6 +125,46 @@ class PDFNotesWidget(gtk.VBox, WindowSidePaneWidget):
         self.scale = 1
         self.img_scale = None
         
+        # rendered page
+        self.surface = None
+        self.surface_page = None
+        self.surface_scale = None
+        self.surface_area = None
+        self.render_timeout = None
+        self.render_server = None
+        self.render_pending = None
+        self.zoom_anchor = None
+        
+        # rendered pages by page, scale and device scale
+        self.surfaces = OrderedDict()
+        self.device_scale = get_device_scale()
+        
+        # recognition of scanned pages
+        self.ocr_pool = None
+        
+        # monitoring of the open file
+        self.file_monitor = None
+        self.reload_timeout = None
+        self.verify_idle = None
+        self.hash_idle = None
+        self.fingerprint_idle = None
+        
+        # draft quality during interaction
+        self.draft = False
+        self.draft_timeout = None
+        self.layout_idle = None
+        
+        # import of annotations in the background
+        self.import_idle = None
+        
+        # recording of interaction
+        self.recorder = None
+        
+        # index of sources of inserted notes
+        self.sources = None
+        self.sources_idle = None
+        self.shown_source = None
+        
         # document to view
         self.document = PDFDocument()
         
@@ -132,14 +178,41 @@ class PDFNotesWidget(gtk.VBox, WindowSidePaneWidget):
         
         # selection
         self.selection_style = self.SELECT_LINE
+        self.text_style = self.SELECT_LINE
         self.unselect()
         
+        # collected selections
+        self.collected = list()
+        
         # cursor
         self.cursor_in = gtk.gdk.Cursor(gtk.gdk.HAND1)
         
+        # user interface is created when the tab is shown
+        self.ui_created = False
+        self.connect('map', self.on_map)
+        self.connect('destroy', self.on_destroy)
+        
+    def on_map(self, *e):
+        
+        # already created
+        if self.ui_created :
+            return
+        
+        logger.debug('PDF Notes: create user interface')
+        self.ui_created = True
+        
         # user interface
         self.set_ui()
+        self.set_render_server()
+        
+        # record events for replay
+        from .tracing import TraceRecorder, get_trace_path
         
+        if get_trace_path() :
+            self.recorder = TraceRecorder(get_trace_path())
+        
+        # open the last document
+        self.restore_last_file()
         
     def set_ui(self):
         
@@ -193,7 +266,7 @@ class PDFNotesWidget(gtk.VBox, WindowSidePaneWidget):
         self.selection_button.connect('changed', self.on_selection_changed)
         
         # toolbar / selection options
-        for option in (self.SELECT_LINE, self.SELECT_IMAGE) :
+        for option in (self.SELECT_LINE, self.SELECT_PARAGRAPH, self.SELECT_IMAGE, self.SELECT_TABLE) :
             self.selection_button.append_text(option)
             
         gtk_combobox_set_active_text(self.selection_button, self.selection_style)
@@ -210,6 +283,11 @@ class PDFNotesWidget(gtk.VBox, WindowSidePaneWidget):
         img_button = IconButton(gtk.STOCK_ZOOM_FIT, False)
         img_button.connect('clicked', self.on_image_scale)
 
+        # toolbar - button for collecting selections
+        self.collect_button = gtk.ToggleButton(_('Collect'))
+        self.collect_button.set_relief(gtk.RELIEF_NONE)
+        self.collect_button.connect('toggled', self.on_collect_toggled)
+
         # toolbar - pack all
         
         toolbar.pack_start(open_button, False, False, 0)
@@ -223,6 +301,7 @@ class PDFNotesWidget(gtk.VBox, WindowSidePaneWidget):
         toolbar.pack_start(self.selection_button, False, False, 0)
         #toolbar.pack_start(self.switch_button, False, False, 0)
         toolbar.pack_start(img_button, False, False, 0)
+        toolbar.pack_start(self.collect_button, False, False, 0)
         
         pane.pack_start(toolbar, False, False, 0)
 
@@ -234,6 +313,7 @@ class PDFNotesWidget(gtk.VBox, WindowSidePaneWidget):
         self.drawing_area.connect("motion-notify-event", self.on_motion)
         self.drawing_area.connect("button_press_event", self.on_button_press)
         self.drawing_area.connect("button_release_event", self.on_button_release)
+        self.drawing_area.connect("size-allocate", self.on_drawing_area_resize)
         
         self.drawing_area.add_events(  gtk.gdk.LEAVE_NOTIFY_MASK
                                      | gtk.gdk.BUTTON_PRESS_MASK
@@ -252,6 +332,8 @@ class PDFNotesWidget(gtk.VBox, WindowSidePaneWidget):
         self.scrolled_w = ScrolledWindow(self.viewport)
         self.scrolled_w.connect("size-allocate", self.on_resize)
         self.scrolled_w.connect("scroll-event", self.on_scroll)
+        self.scrolled_w.get_hadjustment().connect("value-changed", self.on_view_changed)
+        self.scrolled_w.get_vadjustment().connect("value-changed", self.on_view_changed)
         
         # widget pane - pack all        
         self.ui.mainwindow.connect('key-press-event', self.on_key_press)
@@ -259,6 +341,39 @@ class PDFNotesWidget(gtk.VBox, WindowSidePaneWidget):
         
         pane.pack_start(self.scrolled_w, True, True, 0)
         
+        # list of collected selections
+        self.collected_store = gtk.ListStore(str, str)
+        
+        collected_view = gtk.TreeView(self.collected_store)
+        collected_view.append_column(gtk.TreeViewColumn(_('Page'), gtk.CellRendererText(), text=0))
+        collected_view.append_column(gtk.TreeViewColumn(_('Selection'), gtk.CellRendererText(), text=1))
+        
+        collected_w = ScrolledWindow(collected_view)
+        collected_w.set_size_request(-1, 120)
+        
+        self.insert_collected_button = gtk.Button()
+        self.insert_collected_button.connect('clicked', self.on_insert_collected)
+        
+        clear_button = IconButton(gtk.STOCK_CLEAR, False)
+        clear_button.connect('clicked', self.on_clear_collected)
+        
+        collected_bar = gtk.HBox()
+        collected_bar.pack_start(self.insert_collected_button, False, False, 0)
+        collected_bar.pack_end(clear_button, False, False, 0)
+        
+        self.collected_box = gtk.VBox(False, 2)
+        self.collected_box.pack_start(collected_w, True, True, 0)
+        self.collected_box.pack_start(collected_bar, False, False, 0)
+        
+        # show the list only in collect mode
+        for child in self.collected_box.get_children():
+            child.show_all()
+            
+        self.collected_box.set_no_show_all(True)
+        self.update_collected()
+        
+        pane.pack_start(self.collected_box, False, False, 0)
+        
         self.add(pane)
         self.show_all()
     
@@ -268,10 +383,11 @@ class PDFNotesWidget(gtk.VBox, WindowSidePaneWidget):
         # forget the selection
         self.selected_text = None
         self.selected_area = list()
+        self.selected_table = None
         
-        # set the default text selection style
+        # set the text selection style used before dragging
         if self.selection_style == self.SELECT_TEXT:
-            self.selection_style = self.SELECT_LINE
+            self.selection_style = self.text_style
        
     def point_in_area(self, x, y, area):
         
@@ -295,11 +411,308 @@ class PDFNotesWidget(gtk.VBox, WindowSidePaneWidget):
         file = dialog.run()
         # proceed file
         if file :
+            # keep the preview of the current document
+            self.save_preview()
+            # forget the rendered page
+            self.surface = None
             # set document
-            self.document.set_file(file)
-            # update widget
+            self.open_file(file)
+    
+    def open_file(self, file):
+        
+        # set document
+        self.document.set_file(file)
+        
+        # rendered pages belong to the previous document
+        self.surfaces.clear()
+        
+        # collected selections belong to the previous document
+        self.on_clear_collected()
+        self.show_document()
+        
+    def show_document(self):
+        
+        # no file is open
+        if not self.document.exists() :
+            return
+        
+        # reload the file when it changes
+        self.watch_file()
+        self.start_hashing()
+        
+        # restore the reading state of document
+        state = self.uistate['documents'].get(self.document.file.path)
+        
+        if state :
+            self.restore_state(state)
+        
+        # update widget
+        self.unselect()
+        self.update()
+        
+    def watch_file(self):
+        
+        self.unwatch_file()
+        
+        self.file_monitor = gio.File(self.document.file.path).monitor_file()
+        self.file_monitor.connect('changed', self.on_file_changed)
+        
+    def unwatch_file(self):
+        
+        if self.file_monitor != None :
+            self.file_monitor.cancel()
+            self.file_monitor = None
+        
+        if self.reload_timeout != None :
+            gobject.source_remove(self.reload_timeout)
+            self.reload_timeout = None
+    
+    def on_file_changed(self, monitor, file, other_file, event):
+        
+        if event not in (gio.FILE_MONITOR_EVENT_CHANGED,
+                         gio.FILE_MONITOR_EVENT_CHANGES_DONE_HINT,
+                         gio.FILE_MONITOR_EVENT_CREATED) :
+            return
+        
+        logger.debug('PDF Notes: file changed')
+        
+        # reload when the file is written completely
+        if self.reload_timeout != None :
+            gobject.source_remove(self.reload_timeout)
+        
+        self.reload_timeout = gobject.timeout_add(RELOAD_DELAY, self.on_reload_timeout)
+        
+    def on_reload_timeout(self):
+        
+        self.reload_timeout = None
+        
+        # the file is still being written
+        if not self.document.exists() or not os.path.exists(self.document.file.path) :
+            return False
+        
+        changed = self.document.reload()
+        
+        # reloading failed, keep the old document
+        if changed == None :
+            return False
+        
+        # workers open the file again
+        if self.render_server != None :
+            self.render_server.close_document("file://" + self.document.file.path)
+            self.render_pending = None
+        
+        # render the current page again, if it changed
+        if self.document.page_number in changed :
+            self.surface_page = None
             self.unselect()
-            self.update()
+        
+        # forget rendered pages that changed or cannot be compared
+        self.forget_surfaces(changed.union(key[0] for key in self.surfaces 
+                                           if key[0] not in self.document.fingerprints))
+        
+        # hash of the new content
+        self.start_hashing()
+        
+        # compare the other pages in the background
+        if self.verify_idle == None :
+            self.verify_idle = gobject.idle_add(self.on_verify_idle, priority=gobject.PRIORITY_LOW)
+        
+        self.update()
+        
+        # do not repeat
+        return False
+    
+    def start_hashing(self):
+        
+        if self.hash_idle != None :
+            gobject.source_remove(self.hash_idle)
+            self.hash_idle = None
+        
+        # hash the file in the background, links and OCR need it
+        if self.document.exists() and self.document.file_hash == None :
+            self.hash_idle = gobject.idle_add(self.on_hash_idle, self.document.hash_file(),
+                                              priority=gobject.PRIORITY_LOW)
+        
+    def on_hash_idle(self, blocks):
+        
+        try:
+            next(blocks)
+        except StopIteration:
+            self.hash_idle = None
+            self.on_file_hashed()
+            return False
+        except Exception:
+            logger.exception('PDF Notes: cannot hash file')
+            self.hash_idle = None
+            return False
+        
+        # continue with the next block
+        return True
+        
+    def on_file_hashed(self):
+        
+        file_hash = self.document.file_hash
+        logger.debug('PDF Notes: file hashed')
+        
+        # links inserted before the file was hashed
+        if self.sources != None :
+            self.sources.set_hash(self.document.file.path, file_hash)
+            self.save_sources()
+        
+        # compare the shown source with the file
+        if self.shown_source != None :
+            if self.get_sources().get_hash(self.shown_source) not in (None, file_hash) :
+                logger.warning('PDF Notes: source file %s was modified', self.document.file.path)
+            
+            self.shown_source = None
+        
+        # the current page waits for recognized text
+        layout = self.document.get_layout()
+        
+        if layout and layout.is_empty() :
+            self.recognize_page(self.document.page_number)
+        
+    def on_verify_idle(self):
+        
+        if not self.document.exists() :
+            self.verify_idle = None
+            return False
+        
+        self.forget_surfaces(self.document.verify_pages())
+        
+        # repeat until all pages are compared
+        if not self.document.unverified :
+            self.verify_idle = None
+            return False
+        
+        return True
+    
+    def forget_surfaces(self, pages):
+        
+        for key in list(self.surfaces) :
+            if key[0] in pages :
+                del self.surfaces[key]
+        
+    def restore_last_file(self):
+        
+        # the document is still open or it was open last time
+        if self.document.exists() :
+            path = self.document.file.path
+        else :
+            path = self.uistate['last_file']
+        
+        # no file to restore
+        if not path or not os.path.exists(path) :
+            return
+        
+        logger.debug('PDF Notes: restore file %s', path)
+        state = self.uistate['documents'].get(path)
+        
+        # show the cached render of the last page
+        if state :
+            self.load_preview(path, state)
+        
+        # open the document when the window is shown
+        gobject.idle_add(self.on_restore_file, path, priority=gobject.PRIORITY_LOW)
+        
+    def on_restore_file(self, path):
+        
+        # show the open document or open the file
+        if self.document.exists() :
+            self.show_document()
+        else :
+            self.open_file(File(path))
+        
+        # do not repeat
+        return False
+    
+    def restore_state(self, state):
+        logger.debug('PDF Notes: restore state %s', state)
+        
+        # page
+        self.document.set_page(state.get('page', 0))
+        
+        # image scale
+        self.img_scale = state.get('img_scale')
+        
+        # selection style
+        style = state.get('selection')
+        
+        if style in (self.SELECT_LINE, self.SELECT_PARAGRAPH, self.SELECT_IMAGE, self.SELECT_TABLE) :
+            self.selection_style = style
+        
+        # zoom
+        self.zoom = state.get('zoom')
+        key = str(self.zoom) + '%'
+        
+        if not self.zoom :
+            gtk_combobox_set_active_text(self.zoom_button, self.ZOOM_FIT)
+        elif key in self.zoom_options :
+            gtk_combobox_set_active_text(self.zoom_button, key)
+        else :
+            gtk_combobox_set_active_text(self.zoom_button, self.ZOOM_SETTING)
+    
+    def save_state(self):
+        
+        # no file is open or the state is not kept
+        if not self.document.exists() or not self.extension.keep_state :
+            return
+        
+        path = self.document.file.path
+        documents = self.uistate['documents']
+        
+        # save the reading state of document
+        documents[path] = {
+            'page'      : self.document.page_number,
+            'zoom'      : self.zoom,
+            'scale'     : self.scale,
+            'selection' : self.selection_style,
+            'img_scale' : self.img_scale,
+            'time'      : int(time.time()),
+        }
+        
+        # forget the oldest documents
+        while len(documents) > MAX_DOCUMENTS :
+            del documents[min(documents, key=lambda p: documents[p].get('time', 0))]
+        
+        self.uistate['documents'] = documents
+        self.uistate['last_file'] = path
+    
+    def load_preview(self, path, state):
+        
+        preview = get_preview_path(path)
+        
+        # no preview
+        if not os.path.exists(preview) :
+            return
+        
+        try:
+            surface = cairo.ImageSurface.create_from_png(preview)
+        except Exception:
+            logger.exception('PDF Notes: cannot load preview')
+            return
+        
+        # show preview as the rendered page
+        self.surface = surface
+        self.surface_page = state.get('page', 0)
+        self.surface_scale = self.scale = state.get('scale', 1)
+        self.surface_area = None
+        
+        self.drawing_area.set_size_request(surface.get_width(), surface.get_height())
+        self.drawing_area.queue_draw()
+    
+    def save_preview(self):
+        
+        # nothing to save, only a part of the page is rendered or the state is not kept
+        if not self.document.exists() or self.surface == None or self.surface_area != None \
+           or not self.extension.keep_state :
+            return
+        
+        # save the rendered page
+        try:
+            self.surface.write_to_png(get_preview_path(self.document.file.path))
+        except Exception:
+            logger.exception('PDF Notes: cannot save preview')
 
     def on_page_down(self, *e):
         logger.debug('PDF Notes: show next page')
@@ -350,10 +763,123 @@ class PDFNotesWidget(gtk.VBox, WindowSidePaneWidget):
             
             logger.debug('PDF Notes: resize')
             self.boundary = allocation
-            self.update()
+            
+            # scale the current page and render it when the size settles
+            self.start_interaction()
+            self.update(delay=RESIZE_DELAY)
+        
+    def on_preferences_changed(self, changed):
+        logger.debug('PDF Notes: preferences changed %s', changed)
+        
+        # the image size is used only by new snippets,
+        # so the rendered page stays valid
+        
+        # forget keys pressed with the old shortcut
+        if 'switch_mode' in changed :
+            self.keys = set()
+        
+        # stop recognition, recognized pages stay in the cache
+        if 'ocr' in changed and not self.preferences['ocr'] and self.ocr_pool != None :
+            self.ocr_pool.stop()
+            self.ocr_pool = None
+        
+        # start or stop rendering in processes, the page stays valid
+        if 'render_process' in changed and self.ui_created :
+            self.set_render_server()
+            
+    def set_render_server(self):
+        
+        # start workers
+        if self.preferences['render_process'] and self.render_server == None :
+            from .server import RenderServer
+            self.render_server = RenderServer()
+        
+        # stop workers
+        elif not self.preferences['render_process'] and self.render_server != None :
+            self.render_server.stop()
+            self.render_server = None
+            self.render_pending = None
+        
+    def start_interaction(self):
+        
+        # draw in draft quality until the interaction stops
+        self.draft = True
+        
+        if self.draft_timeout != None :
+            gobject.source_remove(self.draft_timeout)
+            
+        self.draft_timeout = gobject.timeout_add(DRAFT_DELAY, self.on_draft_timeout)
+        
+    def on_draft_timeout(self):
+        logger.debug('PDF Notes: interaction stopped')
+        
+        self.draft = False
+        self.draft_timeout = None
+        
+        # replace the draft render, unless a render is scheduled
+        if self.document.exists() and not self.is_rendered() and self.render_timeout == None :
+            self.predraw()
+            
+        self.redraw()
+        
+        # do not repeat
+        return False
+        
+    def on_destroy(self, *e):
+        self.cancel_predraw()
+        self.unwatch_file()
+        
+        if self.ocr_pool != None :
+            self.ocr_pool.stop()
+        
+        if self.draft_timeout != None :
+            gobject.source_remove(self.draft_timeout)
+        
+        if self.render_server != None :
+            self.render_server.stop()
+            self.render_server = None
+        
+        if self.layout_idle != None :
+            gobject.source_remove(self.layout_idle)
+        
+        if self.verify_idle != None :
+            gobject.source_remove(self.verify_idle)
+        
+        if self.hash_idle != None :
+            gobject.source_remove(self.hash_idle)
+        
+        if self.fingerprint_idle != None :
+            gobject.source_remove(self.fingerprint_idle)
+        
+        if self.sources_idle != None :
+            gobject.source_remove(self.sources_idle)
+        
+        # write the new links
+        if self.sources != None :
+            self.sources.save()
+        
+        if self.import_idle != None :
+            gobject.source_remove(self.import_idle)
+        
+        if self.recorder != None :
+            self.recorder.close()
+            self.recorder = None
+        
+        # the tab was never shown
+        if not self.ui_created :
+            return
+        
+        self.save_state()
+        self.save_preview()
+        
+    def record(self, kind, event=None):
+        
+        if self.recorder != None :
+            self.recorder.record(kind, event, self)
         
     def on_zoom(self, *e):
         logger.debug('PDF Notes: zoom changed')
+        self.record('zoom')
         
         # get zoom from toolbar
         key = self.zoom_button.get_active_text()
@@ -386,13 +912,16 @@ class PDFNotesWidget(gtk.VBox, WindowSidePaneWidget):
         
             self.selection_style = style
             self.unselect()
+            self.save_state()
             self.redraw()
     
     def on_image_scale(self, *e) :       
         self.img_scale = self.scale
+        self.save_state()
         
     def on_motion(self, widget, event, *e):
         logger.debug('PDF Notes: motion x=%s y=%s', event.x, event.y)
+        self.record('motion', event)
         
         # get point
         x = event.x / self.scale
@@ -401,13 +930,18 @@ class PDFNotesWidget(gtk.VBox, WindowSidePaneWidget):
         # no file
         if not self.document.exists() :
             return      
+        
+        # dragging
+        if self.drag :
+            self.start_interaction()
 
         # setting cursor
         cursor = self.cursor_in if self.point_in_area(x, y, self.selected_area) else None
         self.drawing_area.window.set_cursor(cursor)
         
-        # uniting select line and select text modes
-        if self.selection_style == self.SELECT_LINE and self.drag :
+        # uniting select line or paragraph and select text modes
+        if self.selection_style in (self.SELECT_LINE, self.SELECT_PARAGRAPH) and self.drag :
+            self.text_style = self.selection_style
             self.selection_style = self.SELECT_TEXT
                 
         logger.debug('PDF Notes: %s', self.selection_style)
@@ -416,6 +950,26 @@ class PDFNotesWidget(gtk.VBox, WindowSidePaneWidget):
         if self.selection_style == self.SELECT_LINE and not self.drag :
             
             text, area = self.document.find_line(x, y, x, y)
+            layout = self.document.get_layout()
+            
+            # line of recognized text
+            if not text and layout :
+                text, area = layout.find_line(x, y)
+            
+            self.selected_text = text
+            self.selected_area = area
+            self.redraw()
+            
+        # find paragraph
+        elif self.selection_style == self.SELECT_PARAGRAPH and not self.drag :
+            
+            layout = self.document.get_layout()
+            
+            # layout is not ready yet
+            if not layout :
+                return
+            
+            text, area = layout.find_paragraph(x, y)
             
             self.selected_text = text
             self.selected_area = area
@@ -424,16 +978,46 @@ class PDFNotesWidget(gtk.VBox, WindowSidePaneWidget):
         # find text            
         elif self.selection_style == self.SELECT_TEXT and self.drag :
             
-            text, area = self.document.find_text(min(self.x, x), min(self.y, y), 
-                                                 max(self.x, x), max(self.y, y))
-                                                 
-            text = re.sub("[\n\r\f\v]", " ", text)
+            selection = (min(self.x, x), min(self.y, y), max(self.x, x), max(self.y, y))
+            layout = self.document.get_layout()
+            
+            # text in the reading order
+            if layout :
+                text, area = layout.find_text(*selection)
+            
+            # text in the order of poppler
+            else :
+                text, area = self.document.find_text(*selection)
+                
+                if text :
+                    text = re.sub("[\n\r\f\v]", " ", text)
             
             if area :
                 self.selected_text = text
                 self.selected_area = area
                 self.redraw()
         
+        # find table
+        elif self.selection_style == self.SELECT_TABLE and self.drag:
+            
+            selection = (min(self.x, x), min(self.y, y), max(self.x, x), max(self.y, y))
+            layout = self.document.get_layout()
+            
+            # layout is not ready yet, select the area
+            if layout :
+                rows, areas = layout.find_table(*selection)
+            else :
+                rows, areas = None, None
+                self.schedule_layout()
+            
+            # cells of table or the selected area
+            from .export import table_to_text
+            
+            self.selected_table = (rows, selection) if rows else None
+            self.selected_text = table_to_text(rows) if rows else None
+            self.selected_area = areas or [selection]
+            self.redraw()
+        
         # find image
         elif self.selection_style == self.SELECT_IMAGE and self.drag:
             
@@ -443,6 +1027,12 @@ class PDFNotesWidget(gtk.VBox, WindowSidePaneWidget):
     
     def on_button_press(self, widget, event, *e):
         logger.debug('PDF Notes: button press at x=%s y=%s', event.x, event.y)
+        self.record('press', event)
+        
+        # context menu
+        if event.button == 3 :
+            self.popup_menu(event)
+            return True
         
         self.drag = True
         self.x = event.x / self.scale
@@ -450,6 +1040,11 @@ class PDFNotesWidget(gtk.VBox, WindowSidePaneWidget):
             
     def on_button_release(self, widget, event, *e):
         logger.debug('PDF Notes: button release at x=%s y=%s', event.x, event.y)
+        self.record('release', event)
+        
+        # handled by context menu
+        if event.button == 3 :
+            return True
 
         no_motion = (event.x / self.scale) == self.x and (event.y / self.scale) == self.y  
         
@@ -461,27 +1056,52 @@ class PDFNotesWidget(gtk.VBox, WindowSidePaneWidget):
             # if clicked on selected area, insert image
             if self.point_in_area(self.x, self.y, self.selected_area) :
                 
+                # collect image
+                if self.collect_button.get_active():
+                    self.collect('image')
+                
                 # insert image
-                self.insert_image_into_notebook()
-                self.insert_text_into_notebook('\n')
+                else:
+                    self.insert_image_into_notebook()
+                    self.insert_text_into_notebook('\n')
             
-            # unselect area
-            self.unselect()
+                # unselect area
+                self.unselect()
+            
+            # select the embedded image or unselect area
+            else :
+                self.select_embedded_image(self.x, self.y)
         
         elif no_motion and style == self.SELECT_TEXT:
             
             # if clicked on selected area, insert text
             if self.point_in_area(self.x, self.y, self.selected_area) :
-                self.insert_text_into_notebook(self.selected_text)
+                self.insert_selected_text()
+            
+            # unselect area
+            self.unselect()
+            
+        elif no_motion and style == self.SELECT_TABLE:
+            
+            # if clicked on selected table, insert table
+            if self.selected_table and self.point_in_area(self.x, self.y, [self.selected_table[1]]) :
+                
+                # collect table
+                if self.collect_button.get_active():
+                    self.collect('table')
+                
+                # insert table
+                else:
+                    self.insert_table_into_notebook()
             
             # unselect area
             self.unselect()
             
-        elif no_motion and style == self.SELECT_LINE:
+        elif no_motion and style in (self.SELECT_LINE, self.SELECT_PARAGRAPH):
             
             # if clicked on selected area, insert line
             if self.point_in_area(self.x, self.y, self.selected_area) :
-                self.insert_text_into_notebook(self.selected_text)
+                self.insert_selected_text()
                 
             # unselect area
             else : self.unselect()
@@ -492,20 +1112,229 @@ class PDFNotesWidget(gtk.VBox, WindowSidePaneWidget):
         self.x = 0
         self.y = 0
         
-    def on_scroll(self, widget, event, *e):
-        logger.debug('PDF Notes: scroll')
+    def popup_menu(self, event):
         
-        # ZOOMING
-        zoom = self.scale * 100  
-  
-        if self.is_pressed_key('Control_L', 'Control_R' ) :
-            logger.debug('PDF Notes: scroll %s ', str(event.direction))
+        # no file
+        if not self.document.exists() :
+            return
+        
+        menu = gtk.Menu()
+        
+        for label, handler, sensitive in (
+            (_('Copy text'), self.on_copy_text, bool(self.selected_text)),
+            (_('Copy image'), self.on_copy_image, bool(self.selected_area)),
+            (_('Insert original image'), self.on_insert_original_image, self.is_original_image()),
+            (_('Import annotations'), self.on_import_annotations, self.import_idle == None),
+            ) :
             
-            # zoom in
-            if event.direction == gtk.gdk.SCROLL_UP and zoom < 400 : 
-                self.zoom = zoom + 20
-                 
-            # zoom out
+            item = gtk.MenuItem(label)
+            item.connect('activate', handler)
+            item.set_sensitive(sensitive)
+            menu.append(item)
+        
+        menu.show_all()
+        menu.popup(None, None, None, event.button, event.time)
+        
+    def on_copy_text(self, *e):
+        
+        if self.selected_text :
+            from .export import copy_text_to_clipboard
+            copy_text_to_clipboard(self.edit_text(self.selected_text))
+        
+    def is_original_image(self):
+        
+        # each selected area is an embedded image
+        return self.selection_style == self.SELECT_IMAGE and bool(self.selected_area) \
+               and all(self.document.find_image_in(*area)[1] for area in self.selected_area)
+        
+    def on_insert_original_image(self, *e):
+        
+        if not self.is_original_image() :
+            return
+        
+        # collect image
+        if self.collect_button.get_active():
+            self.collect('image', original=True)
+        
+        # insert image
+        else:
+            self.insert_image_into_notebook(original=True)
+            self.insert_text_into_notebook('\n')
+        
+        self.unselect()
+        self.redraw()
+        
+    def on_copy_image(self, *e):
+        
+        # nothing selected
+        if not self.selected_area :
+            return
+        
+        # copy all selected areas as one image
+        area = (min(a[0] for a in self.selected_area),
+                min(a[1] for a in self.selected_area),
+                max(a[2] for a in self.selected_area),
+                max(a[3] for a in self.selected_area))
+        
+        from .export import copy_image_to_clipboard
+        
+        # the clipboard holds the whole image, so its size is limited
+        image, scale = self.render_image(self.document.page, area, MAX_SURFACE_SIZE)
+        copy_image_to_clipboard(image)
+        
+    def on_import_annotations(self, *e):
+        logger.debug('PDF Notes: import annotations')
+        
+        # no file or already importing
+        if not self.document.exists() or self.import_idle != None :
+            return
+        
+        # write into the attachments of the new page
+        title = os.path.splitext(os.path.basename(self.document.file.path))[0]
+        target = self.get_annotations_page(get_page_name(title))
+        
+        # scan pages in the background
+        scan = self.scan_annotations(self.document.file.path, target)
+        self.import_idle = gobject.idle_add(self.on_import_idle, scan, title, target, 
+                                            priority=gobject.PRIORITY_LOW)
+        
+    def get_annotations_page(self, name):
+        
+        parent = self.ui.page.name + ':' if self.ui.page else ''
+        path = Path(parent + name)
+        count = 1
+        
+        # do not overwrite notes
+        while self.ui.notebook.get_page(path).hascontent :
+            count += 1
+            path = Path(parent + name + ' ' + str(count))
+        
+        return self.ui.notebook.get_page(path)
+    
+    def scan_annotations(self, file_path, target):
+        '''
+        Generator of annotations of all pages, which stops after
+        each ANNOT_PAGES pages. Yields None while scanning and finally
+        list of pages with annotations.
+        '''
+        pages = list()
+        
+        for page_number in range(self.document.pages_count):
+            
+            # the file was closed or reloaded
+            if not self.document.exists() or self.document.file.path != file_path :
+                return
+            
+            annotations = list()
+            page = self.document.get_page(page_number)
+            
+            for kind, areas, contents, author in self.document.get_annotations(page_number):
+                
+                text = u''
+                images = list()
+                
+                # marked text
+                if kind in TEXT_ANNOTS :
+                    text = self.document.get_annotated_text(page_number, areas)
+                
+                # snapshot of the annotated region
+                if self.preferences['annotation_images'] :
+                    images.append(self.save_annotation_image(page, areas, target))
+                
+                annotations.append((kind, text, contents, author, images))
+            
+            if annotations :
+                pages.append((page_number, annotations))
+            
+            if page_number % ANNOT_PAGES == ANNOT_PAGES - 1 :
+                yield None
+        
+        yield pages
+        
+    def save_annotation_image(self, page, areas, target):
+        
+        area = (min(a[0] for a in areas), min(a[1] for a in areas),
+                max(a[2] for a in areas), max(a[3] for a in areas))
+        
+        path, scale = self.save_image(page, area, target)
+        src = self.ui.notebook.relative_filepath(File(path), target)
+        
+        # the same size as inserted images
+        page_width = page.get_size()[0]
+        width = abs(area[2] - area[0]) * min(scale, 700.0 / page_width)
+        
+        return src, max(1, int(width))
+    
+    def on_import_idle(self, scan, title, target):
+        
+        try:
+            pages = next(scan)
+        except StopIteration:
+            pages = list()
+        except Exception:
+            logger.exception('PDF Notes: cannot import annotations')
+            pages = list()
+        
+        # continue scanning
+        if pages == None :
+            return True
+        
+        self.import_idle = None
+        
+        logger.info('PDF Notes: imported %s annotations from %s pages', 
+                    sum(len(a) for p, a in pages), len(pages))
+        
+        # nothing to write
+        if not pages :
+            return False
+        
+        # write the whole page at once
+        target.parse('wiki', format_annotations(title, pages))
+        self.ui.notebook.store_page(target)
+        self.ui.open_page(target)
+        
+        # do not repeat
+        return False
+    
+    def select_embedded_image(self, x, y):
+        
+        self.unselect()
+        image_id, area = self.document.find_image(x, y)
+        
+        # select the area of image
+        if area :
+            logger.debug('PDF Notes: select embedded image %s', image_id)
+            self.selected_area = [area]
+        
+    def insert_selected_text(self):
+        
+        # collect text
+        if self.collect_button.get_active():
+            self.collect('text')
+        
+        # insert text
+        else:
+            self.insert_text_into_notebook(self.selected_text, 
+                                           (self.document.page_number, self.selected_area, 'text'))
+        
+    def on_scroll(self, widget, event, *e):
+        logger.debug('PDF Notes: scroll')
+        self.record('scroll', event)
+        
+        # scrolling, zooming or turning pages
+        self.start_interaction()
+        
+        # ZOOMING
+        zoom = self.scale * 100 / self.device_scale
+  
+        if self.is_pressed_key('Control_L', 'Control_R' ) :
+            logger.debug('PDF Notes: scroll %s ', str(event.direction))
+            
+            # zoom in
+            if event.direction == gtk.gdk.SCROLL_UP and zoom < 400 : 
+                self.zoom = zoom + 20
+                 
+            # zoom out
             elif event.direction == gtk.gdk.SCROLL_DOWN and zoom >= 40 :
                 self.zoom = zoom - 20
             
@@ -513,11 +1342,14 @@ class PDFNotesWidget(gtk.VBox, WindowSidePaneWidget):
             else:
                 return False
 
+            # keep the point under the pointer in place
+            self.set_zoom_anchor()
+
             # set gui            
             gtk_combobox_set_active_text(self.zoom_button, self.ZOOM_SETTING)
 
-            # update widget
-            self.update()
+            # scale the current page and render it when zooming stops
+            self.update(delay=ZOOM_DELAY)
             return True
             
         # NEXT PAGE
@@ -541,6 +1373,38 @@ class PDFNotesWidget(gtk.VBox, WindowSidePaneWidget):
             
             return True
                 
+    def set_zoom_anchor(self):
+        
+        # get pointer and its position in the page
+        x, y = self.drawing_area.get_pointer()
+        allocation = self.drawing_area.get_allocation()
+        horizontal = self.scrolled_w.get_hadjustment()
+        vertical = self.scrolled_w.get_vadjustment()
+        
+        # remember the point of page and its position in the window
+        self.zoom_anchor = (x / self.scale,
+                            y / self.scale,
+                            allocation.x + x - horizontal.value,
+                            allocation.y + y - vertical.value)
+    
+    def on_drawing_area_resize(self, widget, allocation, *e):
+        
+        # no zooming
+        if not self.zoom_anchor :
+            return
+        
+        logger.debug('PDF Notes: scroll to zoom anchor')
+        
+        x, y, view_x, view_y = self.zoom_anchor
+        self.zoom_anchor = None
+        
+        # scroll the point of page back under the pointer
+        for adjustment, value in ((self.scrolled_w.get_hadjustment(), allocation.x + x * self.scale - view_x),
+                                  (self.scrolled_w.get_vadjustment(), allocation.y + y * self.scale - view_y)) :
+            
+            value = min(value, adjustment.upper - adjustment.page_size)
+            adjustment.set_value(max(value, adjustment.lower))
+        
     def on_key_press(self, widget, event, *e):
 
         # TODO - umožnit kopírovat vybrané položky
@@ -597,83 +1461,178 @@ class PDFNotesWidget(gtk.VBox, WindowSidePaneWidget):
           self.selection_style = self.SELECT_IMAGE
       
     
-    def insert_image_into_notebook(self):
+    def insert_table_into_notebook(self):
+        logger.debug('PDF Notes: insert table into notebook')
+        
+        # get text buffer
+        view = self.ui.mainwindow.pageview.view
+        buffer = view.get_buffer()
+        
+        self.insert_table(buffer, self.selected_table[0])
+        self.insert_source_link(buffer, self.document.page_number, self.selected_area, 'table')
+        
+        # scroll to cursor and set focus
+        self.show_cursor(view)
+        
+    def insert_table(self, buffer, rows):
+        
+        # start the table on a new line
+        if not buffer.get_insert_iter().starts_line() :
+            buffer.insert_at_cursor('\n')
+        
+        from .export import table_to_text, table_to_wiki
+        
+        # Zim table, parsed as wiki text
+        try:
+            from zim.formats import get_format
+            tree = get_format('wiki').Parser().parse(table_to_wiki(rows))
+            buffer.insert_parsetree_at_cursor(tree)
+        
+        # cells separated by tabs
+        except Exception:
+            logger.exception('PDF Notes: cannot insert table')
+            buffer.insert_at_cursor(table_to_text(rows) + '\n')
+        
+    def insert_image_into_notebook(self, original=False):
         logger.debug('PDF Notes: insert image into notebook')
         
+        # get text buffer
+        view = self.ui.mainwindow.pageview.view
+        buffer = view.get_buffer()
+        
         # for all areas get and insert image
-        for x1, y1, x2, y2 in self.selected_area:
-            
-            # get scale, width and height of image           
-            
-            width  = abs(x2 - x1)
-            height = abs(y2 - y1)
+        for area in self.selected_area:
             
-            if width > height : scale = self.preferences['image_width'] / float(width); logger.debug('PDF Notes: W')
-            else:               scale = self.preferences['image_height'] / float(height); logger.debug('PDF Notes: H')
+            # render and save image
+            path, scale = self.save_image(self.document.page, area, original=original)
             
-            dx = -x1 * scale
-            dy = -y1 * scale
-            
-            # set surface
-            image = cairo.ImageSurface(cairo.FORMAT_RGB24, 
-                                       int(width * scale),
-                                       int(height * scale)
-                                       )
+            # insert image into notebook
+            self.insert_image(buffer, path, area, scale, self.document.width)
+        
+        # add link to the page and areas of images
+        self.insert_source_link(buffer, self.document.page_number, self.selected_area, 'image')
             
-            context = cairo.Context(image)
+        # scroll to cursor and set focus
+        self.show_cursor(view)
+    
+    def get_image_scale(self, x1, y1, x2, y2, max_size=None):
             
-            # set transition and scale
-            context.translate(dx, dy)
-            context.scale(scale, scale)
+        # get scale, width and height of image           
+        
+        width  = abs(x2 - x1)
+        height = abs(y2 - y1)
+        
+        if width > height : scale = self.preferences['image_width'] / float(width); logger.debug('PDF Notes: W')
+        else:               scale = self.preferences['image_height'] / float(height); logger.debug('PDF Notes: H')
+        
+        # scale down to the max size in bytes
+        if max_size and width * height * scale * scale * 4 > max_size :
+            scale = math.sqrt(max_size / (width * height * 4.0))
+        
+        return scale, max(1, int(width * scale)), max(1, int(height * scale))
+    
+    def render_area(self, context, page, area, scale):
+        
+        # set transition and scale
+        context.translate(-area[0] * scale, -area[1] * scale)
+        context.scale(scale, scale)
+        
+        # render page at surface
+        self.document.render_page(context, page)
+    
+    def render_image(self, page, area, max_size=None):
+        
+        scale, width, height = self.get_image_scale(*area, max_size=max_size)
+        
+        # set surface
+        image = cairo.ImageSurface(cairo.FORMAT_RGB24, width, height)
+        
+        context = cairo.Context(image)
+        self.render_area(context, page, area, scale)
+        
+        return image, scale
+    
+    def save_image(self, page, area, target=None, original=False):
+        
+        # create filename
+        basename = os.path.basename(self.document.file.path)
+        title = os.path.splitext(basename)[0]
+        imgname = time.strftime( title + '_%Y-%m-%d-%H%M%S')
+        
+        # create path in attachments of the current page by default
+        target = target or self.ui.page
+        dir = self.ui.notebook.get_attachments_dir(target).path
+        path = dir + os.path.sep + imgname + '.png'
+        
+        # more images in the same second
+        count = 1
+        
+        while os.path.exists(path):
+            count += 1
+            path = dir + os.path.sep + imgname + '_' + str(count) + '.png'
             
-            # render page at surface
-            self.document.render_page(context)
+        # create dirs if necessary                
+        if not os.path.exists(dir):
+            os.makedirs(dir)
             
-            # create filename
-            basename = os.path.basename(self.document.file.path)
-            title = os.path.splitext(basename)[0]
-            imgname = time.strftime( title + '_%Y-%m-%d-%H%M%S.png')
+        # get size of image
+        scale, width, height = self.get_image_scale(*area)
+        image_id, image_area = None, None
+        
+        # the embedded image, if it was asked for
+        if original :
+            image_id, image_area = self.document.find_image_in(*area, page=page)
+        
+        # write the embedded image in its own resolution
+        if image_area :
+            logger.debug('PDF Notes: save embedded image %s', image_id)
+            image = self.document.get_image(image_id, page)
+            scale = image.get_width() / float(abs(area[2] - area[0]))
             
-            # create path
-            page = self.ui.page
-            dir = self.ui.notebook.get_attachments_dir(page).path
-            path = dir + os.path.sep + imgname
-                
-            # create dirs if necessary                
-            if not os.path.exists(dir):
-                os.makedirs(dir)
-                
-            # write surface to file
-            with open(path, 'w') as f:
+            with open(path, 'wb') as f:
                 image.write_to_png(f)
+        
+        # render large image in bands to keep memory bounded
+        elif width * height * 4 > MAX_SURFACE_SIZE :
+            from .export import write_png_in_bands
             
-            # insert image into notebook            
-            f = File(path)
-            src = self.ui.notebook.relative_filepath(f, page)
-            
-            # TODO - umožnit nastavit scale vkládaných obrázků
+            with open(path, 'wb') as f:
+                write_png_in_bands(f, width, height, MAX_SURFACE_SIZE,
+                                   lambda context: self.render_area(context, page, area, scale))
+        
+        # write surface to file
+        else :
+            image, scale = self.render_image(page, area)
             
-            if not self.img_scale:
-              attr_scale = min(scale, 700.0 / self.document.width)      
-            else:  
-              attr_scale = self.img_scale
+            with open(path, 'wb') as f:
+                image.write_to_png(f)
+        
+        return path, scale
+    
+    def insert_image(self, buffer, path, area, scale, page_width):
+        
+        x1, y1, x2, y2 = area
+        width  = abs(x2 - x1)
+        height = abs(y2 - y1)
+        
+        # insert image into notebook            
+        f = File(path)
+        src = self.ui.notebook.relative_filepath(f, self.ui.page)
+        
+        # TODO - umožnit nastavit scale vkládaných obrázků
+        
+        if not self.img_scale:
+          attr_scale = min(scale, 700.0 / page_width)      
+        else:  
+          attr_scale = self.img_scale
 
-            attr = {'width'  : abs(int(width * attr_scale )), 
-                    'height' : abs(int(height * attr_scale ))
-                    }
-            
-            view = self.ui.mainwindow.pageview.view
-            buffer = view.get_buffer()
-            buffer.insert_image_at_cursor(f, src, **attr)
-            
-            # scroll to cursor
-            mark = buffer.get_insert()
-            view.scroll_mark_onscreen(mark)
-            
-            # set focus
-            view.grab_focus()
-            
-            logger.debug('PDF Notes: image inserted at %s', path)
+        attr = {'width'  : abs(int(width * attr_scale )), 
+                'height' : abs(int(height * attr_scale ))
+                }
+        
+        buffer.insert_image_at_cursor(f, src, **attr)
+        
+        logger.debug('PDF Notes: image inserted at %s', path)
     
     def edit_text(self, text):
         
@@ -684,15 +1643,27 @@ class PDFNotesWidget(gtk.VBox, WindowSidePaneWidget):
 
         return result
     
-    def insert_text_into_notebook(self, text):
+    def insert_text_into_notebook(self, text, source=None):
         
         logger.debug('PDF Notes: insert text into notebook')
         
-        ## MAGIC, DON'T TOUCH !!!
-        
         # get text buffer        
         view = self.ui.mainwindow.pageview.view
         buffer = view.get_buffer()
+        
+        # add text
+        self.insert_text(buffer, text)
+        
+        # add link to the page and areas of text
+        if source :
+            self.insert_source_link(buffer, *source)
+        
+        # scroll to cursor and set focus
+        self.show_cursor(view)
+        
+    def insert_text(self, buffer, text):
+        
+        ## MAGIC, DON'T TOUCH !!!
 
         # get current line
         line = buffer.get_insert_iter().get_line()
@@ -725,18 +1696,237 @@ class PDFNotesWidget(gtk.VBox, WindowSidePaneWidget):
         # add text
         string = self.edit_text(text)
         buffer.do_insert_text(iter, string, len(string))
+        
+        # move cursor behind the text
+        buffer.place_cursor(iter)
 
+        logger.debug('PDF Notes: text inserted: %s', string)
+        
+    def get_sources(self):
+        
+        if self.sources == None :
+            self.sources = SourceIndex(get_index_path(self.ui.notebook))
+        
+        return self.sources
+    
+    def insert_source_link(self, buffer, page_number, areas, kind):
+        
+        # links are disabled, cannot be opened or nothing to link
+        if not self.preferences['source_links'] or not self.extension.source_links \
+           or not areas or not self.document.exists() :
+            return
+        
+        # file without hash is identified by path until it is hashed
+        source_id = self.get_sources().add(self.document.file_hash, self.document.file.path,
+                                           page_number, areas, kind)
+        
+        buffer.insert_at_cursor(' ')
+        buffer.insert_link_at_cursor(_('p. %i') % (page_number + 1), get_link(source_id))
+        
+        logger.debug('PDF Notes: link to source %s inserted', source_id)
+        self.save_sources()
+        
+    def save_sources(self):
+        
+        # write the index once for all links of the action
+        if self.sources_idle == None :
+            self.sources_idle = gobject.idle_add(self.on_sources_idle, priority=gobject.PRIORITY_LOW)
+        
+    def on_sources_idle(self):
+        
+        self.sources_idle = None
+        self.sources.save()
+        
+        # do not repeat
+        return False
+        
+    def show_source(self, source_id):
+        logger.debug('PDF Notes: show source %s', source_id)
+        
+        # create the user interface, the last file is restored first
+        self.on_map()
+        gobject.idle_add(self.on_show_source, source_id, priority=gobject.PRIORITY_LOW)
+        
+    def on_show_source(self, source_id):
+        
+        source = self.get_sources().resolve(source_id)
+        
+        if source == None :
+            logger.warning('PDF Notes: unknown source %s', source_id)
+            return False
+        
+        path, page_number, areas, kind = source
+        
+        # open the document
+        if not self.document.exists() or self.document.file.path != path :
+            
+            if not path or not os.path.exists(path) :
+                logger.warning('PDF Notes: source file %s not found', path)
+                return False
+            
+            self.save_preview()
+            self.surface = None
+            self.open_file(File(path))
+        
+        file_hash = self.document.file_hash
+        
+        # compare when the file is hashed
+        if file_hash == None :
+            self.shown_source = source_id
+        
+        elif self.get_sources().get_hash(source_id) not in (None, file_hash) :
+            logger.warning('PDF Notes: source file %s was modified', path)
+        
+        # show page and highlight the areas
+        self.document.set_page(min(page_number, self.document.pages_count - 1))
+        self.unselect()
+        
+        if kind == 'image' :
+            self.selection_style = self.SELECT_IMAGE
+        elif kind == 'table' :
+            self.selection_style = self.SELECT_TABLE
+        elif self.selection_style in (self.SELECT_IMAGE, self.SELECT_TABLE) :
+            self.selection_style = self.SELECT_LINE
+        
+        self.selected_area = list(areas)
+        self.update()
+        
+        # scroll when the page has its size
+        gobject.idle_add(self.scroll_to_area, areas[0])
+        
+        # do not repeat
+        return False
+    
+    def scroll_to_area(self, area):
+        
+        vertical = self.scrolled_w.get_vadjustment()
+        allocation = self.drawing_area.get_allocation()
+        
+        # area in the upper third of view
+        value = allocation.y + area[1] * self.scale - vertical.page_size / 3
+        vertical.set_value(max(vertical.lower, min(value, vertical.upper - vertical.page_size)))
+        
+        # do not repeat
+        return False
+        
+    def show_cursor(self, view):
+        
         # scroll to cursor        
-        buffer.place_cursor(iter)
+        buffer = view.get_buffer()
         view.scroll_to_mark(buffer.get_insert(),SCROLL_TO_MARK_MARGIN)
 		    
         # set focus
         view.grab_focus()
-
-        logger.debug('PDF Notes: text inserted: %s', self.selected_text)
-
+        
+    def collect(self, kind, original=False):
+        logger.debug('PDF Notes: collect %s', kind)
+        
+        # save selection with the page reference
+        item = {'kind' : kind,
+                'page' : self.document.page_number,
+                'text' : self.selected_text,
+                'area' : list(self.selected_area),
+                'table': self.selected_table[0] if kind == 'table' else None,
+                'original' : original
+                }
+        
+        self.collected.append(item)
+        
+        # show item in the list
+        if kind == 'image':
+            description = _('Image') + ' %i x %i' % self.get_area_size(item['area'])
+        elif kind == 'table':
+            description = _('Table') + ' %i x %i' % (len(item['table'][0]), len(item['table']))
+        else:
+            description = self.edit_text(item['text'])
+            
+        self.collected_store.append((str(item['page'] + 1), description))
+        self.update_collected()
+        
+    def get_area_size(self, area):
+        
+        width  = max(abs(x2 - x1) for x1, y1, x2, y2 in area)
+        height = max(abs(y2 - y1) for x1, y1, x2, y2 in area)
+        
+        return int(width), int(height)
+        
+    def on_collect_toggled(self, *e):
+        
+        # show or hide the list of collected items
+        if self.collect_button.get_active():
+            self.collected_box.show_all()
+        else:
+            self.collected_box.hide()
+            
+    def on_clear_collected(self, *e):
+        
+        # forget collected items
+        self.collected = list()
+        self.collected_store.clear()
+        self.update_collected()
+        
+    def update_collected(self):
+        
+        # ui - number of items
+        self.insert_collected_button.set_label(_('Insert') + ' (%i)' % len(self.collected))
+        self.insert_collected_button.set_sensitive(bool(self.collected))
+        
+    def on_insert_collected(self, *e):
+        logger.debug('PDF Notes: insert collected items into notebook')
+        
+        # nothing to insert
+        if not self.collected or not self.document.exists():
+            return
+        
+        # render all images page by page
+        images = dict()
+        pages = sorted(set(item['page'] for item in self.collected if item['kind'] == 'image'))
+        
+        for number in pages:
+            
+            page = self.document.get_page(number)
+            page_width = page.get_size()[0]
+            
+            for index, item in enumerate(self.collected):
+                
+                if item['kind'] == 'image' and item['page'] == number:
+                    images[index] = list()
+                    
+                    for area in item['area']:
+                        path, scale = self.save_image(page, area, original=item['original'])
+                        images[index].append((path, area, scale, page_width))
+        
+        # get text buffer
+        view = self.ui.mainwindow.pageview.view
+        buffer = view.get_buffer()
+        
+        # insert all items at once
+        with buffer.user_action:
+            
+            for index, item in enumerate(self.collected):
+                
+                if item['kind'] == 'image':
+                    for image in images[index]:
+                        self.insert_image(buffer, *image)
+                    
+                    self.insert_source_link(buffer, item['page'], item['area'], 'image')
+                    self.insert_text(buffer, '\n')
+                
+                elif item['kind'] == 'table':
+                    self.insert_table(buffer, item['table'])
+                    self.insert_source_link(buffer, item['page'], item['area'], 'table')
+                    
+                else:
+                    self.insert_text(buffer, item['text'])
+                    self.insert_source_link(buffer, item['page'], item['area'], 'text')
+        
+        # scroll to cursor and set focus
+        self.show_cursor(view)
+        
+        # forget collected items
+        self.on_clear_collected()
                 
-    def update(self):
+    def update(self, delay=None):
         logger.debug('PDF Notes: update')
         
         # no file is open
@@ -746,9 +1936,11 @@ class PDFNotesWidget(gtk.VBox, WindowSidePaneWidget):
         # get size of document
         self.width, self.height = self.document.page.get_size()
         
-        # set scale
+        # set scale, zoom is relative to the logical pixels of display
+        self.device_scale = get_device_scale()
+        
         if self.zoom :            
-            self.scale = self.zoom / 100.0
+            self.scale = self.zoom / 100.0 * self.device_scale
         else :
             self.scale = self.scrolled_w.get_hadjustment().page_size / float(self.width)
             
@@ -766,27 +1958,324 @@ class PDFNotesWidget(gtk.VBox, WindowSidePaneWidget):
         gtk_combobox_set_active_text(self.selection_button, self.selection_style)
         logger.debug('PDF Notes: update style %s', self.selection_style)
         
+        # ui - use the page rendered before
+        if not self.is_rendered() :
+            self.use_cached_surface()
+        
+        # ui - render page now or when the size settles
+        if self.is_rendered():
+            self.cancel_predraw()
+        elif delay and self.surface_page == self.document.page_number :
+            self.schedule_predraw(delay)
+        else :
+            self.cancel_predraw()
+            self.predraw(draft=self.draft)
+        
         # ui - redraw widget
-        self.predraw()
         self.redraw()
+        
+        # analyse the page in the background
+        self.schedule_layout()
+        
+        # remember the reading state
+        self.save_state()
+        
+    def schedule_layout(self):
+        
+        # layout is ready or scheduled
+        if self.document.get_layout() or self.layout_idle != None :
+            return
+        
+        self.layout_idle = gobject.idle_add(self.on_layout_idle, priority=gobject.PRIORITY_LOW)
+        
+    def on_layout_idle(self):
+        
+        self.layout_idle = None
+        
+        if self.document.exists() :
+            layout = self.document.create_layout()
+            
+            # page without text
+            if layout.is_empty() :
+                self.recognize_page(self.document.page_number)
+            
+            self.schedule_fingerprints()
+            
+        # do not repeat
+        return False
+    
+    def schedule_fingerprints(self):
+        
+        # only the watched file is reloaded
+        if self.file_monitor == None or self.fingerprint_idle != None :
+            return
+        
+        self.fingerprint_idle = gobject.idle_add(self.on_fingerprint_idle, priority=gobject.PRIORITY_LOW)
+        
+    def on_fingerprint_idle(self):
+        
+        pages = None
+        
+        # not while the file is changing
+        if self.document.exists() and self.file_monitor != None and self.reload_timeout == None :
+            pages = self.document.get_pages_without_fingerprint()
+        
+        if not pages :
+            self.fingerprint_idle = None
+            return False
+        
+        # one page at a time
+        self.document.add_fingerprint(min(pages))
+        return True
+    
+    def recognize_page(self, page_number):
+        
+        from .ocr import OCRPool, has_tesseract
+        
+        file_hash = self.document.file_hash
+        
+        # recognition is disabled or the file is not hashed yet,
+        # the page is recognized when the file is hashed
+        if not self.preferences['ocr'] or file_hash == None :
+            return
+        
+        # recognized before
+        if self.document.load_ocr(page_number) != None :
+            return
+        
+        # not available
+        if not has_tesseract() :
+            return
+        
+        if self.ocr_pool == None :
+            self.ocr_pool = OCRPool()
+        
+        key = (file_hash, page_number)
+        
+        # rendering and recognition run in other processes
+        self.ocr_pool.recognize(key, self.document.file.path, page_number, self.on_page_recognized,
+                                lambda: self.document.exists() and self.document.file_hash == file_hash)
+        
+    def on_page_recognized(self, key, lines):
+        
+        file_hash, page_number = key
+        
+        # failed or the file is not open anymore
+        if lines == None or not self.document.exists() or self.document.file_hash != file_hash :
+            return
+        
+        logger.debug('PDF Notes: text of page %s recognized', page_number)
+        self.document.set_ocr(page_number, lines)
+        
+    def is_rendered(self):
+        
+        if self.surface == None \
+           or self.surface_page != self.document.page_number \
+           or self.surface_scale != self.scale :
+            return False
+        
+        # whole page is rendered
+        if self.surface_area == None :
+            return True
+        
+        # the rendered part covers the visible area
+        x1, y1, x2, y2 = self.surface_area
+        v1, w1, v2, w2 = self.get_visible_area()
+        
+        return x1 <= v1 and y1 <= w1 and v2 <= x2 and w2 <= y2
+    
+    def get_visible_area(self, margin=0):
+        
+        horizontal = self.scrolled_w.get_hadjustment()
+        vertical = self.scrolled_w.get_vadjustment()
+        allocation = self.drawing_area.get_allocation()
+        
+        # visible part of the drawing area extended by margin
+        x1 = horizontal.value - allocation.x - horizontal.page_size * margin
+        y1 = vertical.value - allocation.y - vertical.page_size * margin
+        x2 = x1 + horizontal.page_size * (1 + 2 * margin)
+        y2 = y1 + vertical.page_size * (1 + 2 * margin)
+        
+        # in coordinates of page
+        return (max(0, x1 / self.scale), max(0, y1 / self.scale),
+                min(self.width, x2 / self.scale), min(self.height, y2 / self.scale))
+    
+    def get_render_area(self, scale):
+        
+        # the whole page is small enough
+        if self.width * self.height * scale * scale <= MAX_RENDER_PIXELS :
+            return None
+        
+        # visible area with margin, aligned to pixels of the surface
+        x1, y1, x2, y2 = self.get_visible_area(RENDER_MARGIN)
+        
+        return (int(x1 * scale) / scale, int(y1 * scale) / scale,
+                int(x2 * scale + 1) / scale, int(y2 * scale + 1) / scale)
+    
+    def set_surface(self, surface, page, scale, area=None):
+        
+        self.surface = surface
+        self.surface_page = page
+        self.surface_scale = scale
+        self.surface_area = area
+        
+        # keep whole pages at the full resolution
+        if area != None or scale != self.scale :
+            return
+        
+        key = (page, scale, self.device_scale)
+        self.surfaces.pop(key, None)
+        self.surfaces[key] = surface
+        
+        # forget the least recently shown pages
+        while len(self.surfaces) > MAX_SURFACES :
+            self.surfaces.popitem(last=False)
+    
+    def use_cached_surface(self):
+        
+        key = (self.document.page_number, self.scale, self.device_scale)
+        
+        # the page changed in the reloaded file
+        if self.document.verify_page(key[0]) :
+            self.forget_surfaces([key[0]])
+        
+        surface = self.surfaces.pop(key, None)
+        
+        if surface != None :
+            logger.debug('PDF Notes: use page %s rendered before', key[0])
+            self.surfaces[key] = surface
+            self.surface = surface
+            self.surface_page, self.surface_scale = key[:2]
+            self.surface_area = None
+    
+    def on_view_changed(self, *e):
+        
+        # the rendered part of page does not cover the view anymore
+        if self.surface_area != None and self.document.exists() and not self.is_rendered() :
+            self.start_interaction()
+            self.schedule_predraw(RESIZE_DELAY)
+    
+    def schedule_predraw(self, delay):
+        logger.debug('PDF Notes: schedule predraw')
+        
+        # cancel the previous render
+        self.cancel_predraw()
+        self.render_timeout = gobject.timeout_add(delay, self.on_predraw_timeout)
+        
+    def cancel_predraw(self):
+        
+        if self.render_timeout != None :
+            gobject.source_remove(self.render_timeout)
+            self.render_timeout = None
+            
+    def on_predraw_timeout(self):
+        
+        self.render_timeout = None
+        
+        if self.document.exists() :
+            self.predraw()
+            self.redraw()
+        
+        # do not repeat
+        return False
 
-    def predraw(self):
+    def predraw(self, draft=False, local=False):
         logger.debug('PDF Notes: predraw')
         
+        # render in other process
+        if self.render_server != None and not local :
+            self.predraw_in_server()
+            return
+        
+        # lower resolution during interaction
+        scale = self.scale
+        
+        if draft :
+            scale = scale * DRAFT_RESOLUTION
+        
+        # render only the visible area of large pages
+        area = self.get_render_area(scale)
+        x1, y1, x2, y2 = area or (0, 0, self.width, self.height)
+        
         # create surface
-        self.surface = cairo.ImageSurface(cairo.FORMAT_RGB24, 
-                                          int(self.width * self.scale),
-                                          int(self.height * self.scale))
+        surface = cairo.ImageSurface(cairo.FORMAT_RGB24, 
+                                     int((x2 - x1) * scale),
+                                     int((y2 - y1) * scale))
+        
         # create context
-        context = cairo.Context(self.surface)
+        context = cairo.Context(surface)
+        
+        if draft :
+            context.set_antialias(cairo.ANTIALIAS_NONE)
 
         # scaling
-        if self.scale != 1:
-            context.scale(self.scale, self.scale)
+        if scale != 1:
+            context.scale(scale, scale)
+        
+        context.translate(-x1, -y1)
             
         # rendering
         self.document.render_page(context)
+        self.set_surface(surface, self.document.page_number, scale, area)
 
+    def predraw_in_server(self, attempt=0):
+        
+        path = self.document.file.path
+        page = self.document.page_number
+        scale = self.scale
+        
+        # render only the visible area of large pages
+        area = self.get_render_area(scale)
+        x1, y1, x2, y2 = area or (0, 0, self.width, self.height)
+        
+        width = int((x2 - x1) * scale)
+        height = int((y2 - y1) * scale)
+        
+        # nothing to render or already requested
+        if not width or not height or self.render_pending == (path, page, scale, area) :
+            return
+        
+        self.render_pending = (path, page, scale, area)
+        
+        # keep showing the current surface until the page is rendered
+        self.render_server.render("file://" + path, page, scale, width, height,
+                                  lambda surface: self.on_rendered(surface, path, page, scale, area, attempt),
+                                  x1, y1)
+    
+    def on_rendered(self, surface, path, page, scale, area=None, attempt=0):
+        
+        if self.render_pending == (path, page, scale, area) :
+            self.render_pending = None
+        
+        # out of date
+        if not self.document.exists() \
+           or (path, page, scale) != (self.document.file.path, self.document.page_number, self.scale) :
+            return
+        
+        # failed, crashed workers are already replaced
+        if surface == None :
+            
+            # the page could be rendered by the next request
+            if self.render_pending != None :
+                return
+            
+            if attempt < RENDER_RETRIES :
+                logger.debug('PDF Notes: rendering of page %s failed, repeating', page)
+                self.predraw_in_server(attempt + 1)
+            
+            # render in this process rather than keep the old page
+            else :
+                logger.warning('PDF Notes: rendering of page %s in other process failed', page)
+                self.predraw(local=True)
+                self.redraw()
+            
+            return
+        
+        logger.debug('PDF Notes: page %s rendered in other process', page)
+        
+        self.set_surface(surface, page, scale, area)
+        self.redraw()
+        
     def redraw(self):
         
         if self.document.exists() :
@@ -796,16 +2285,37 @@ class PDFNotesWidget(gtk.VBox, WindowSidePaneWidget):
     def draw(self, widget, event):
         logger.debug('PDF Notes: draw')
         
-        # no file is open
-        if not self.document.exists() :
+        # nothing is rendered
+        if self.surface == None :
             return
         
         # create context
         context = widget.window.cairo_create()
         
-        # draw page
+        if self.draft :
+            context.set_antialias(cairo.ANTIALIAS_NONE)
+        
+        # draw page, scale it if it is not rendered at the current size yet
+        context.save()
+        
+        # white page under the rendered part
+        if self.surface_area != None :
+            context.set_source_rgb(1, 1, 1)
+            context.rectangle(0, 0, self.width * self.scale, self.height * self.scale)
+            context.fill()
+            context.translate(self.surface_area[0] * self.scale, self.surface_area[1] * self.scale)
+        
+        if self.surface_scale != self.scale :
+            ratio = self.scale / self.surface_scale
+            context.scale(ratio, ratio)
+        
         context.set_source_surface(self.surface)
+        
+        if self.draft :
+            context.get_source().set_filter(cairo.FILTER_FAST)
+        
         context.paint()
+        context.restore()
         
         # highlight selected areas
         if self.selected_area:
@@ -850,7 +2360,17 @@ class PDFNotesWidget(gtk.VBox, WindowSidePaneWidget):
                 
                 context.restore()
                 
-        elif style == self.SELECT_LINE or style == self.SELECT_TEXT :
+        elif style == self.SELECT_TABLE \
+             or (style in (self.SELECT_LINE, self.SELECT_PARAGRAPH, self.SELECT_TEXT) \
+                 and (self.draft or self.document.is_scanned())) :
+            # set color
+            context.set_source_rgba(*self.color_sea_light)
+            # fill selected text without rendering glyphs
+            for x1, y1, x2, y2 in self.selected_area:
+                context.rectangle(x1, y1, x2 - x1, y2 - y1)
+            context.fill()
+                
+        elif style in (self.SELECT_LINE, self.SELECT_PARAGRAPH, self.SELECT_TEXT) :
             # set color
             color = self.color_sea
             # render selected text
@@ -0,0 +1,711 @@
+# -*- coding: utf-8 -*-
+
+# Author: Vendula Poncova <poncovka@gmail.com>
+# File: layout.py
+#
+# Description:
+# Layout of text on PDF page: words, lines, paragraphs and columns.
+#
+
+import logging
+
+from array import array
+from bisect import bisect_right
+
+from .lazy import LazyModule
+
+logger = logging.getLogger(__name__)
+
+# optional, queries are vectorized with numpy
+numpy = LazyModule('numpy')
+
+# min gap between cells of table relative to the height of row
+CELL_GAP = 0.8
+
+def decode_text(text):
+
+    # offsets of words count chars, not bytes of UTF-8
+    if isinstance(text, str) :
+        return text.decode('utf-8')
+
+    return text or u''
+
+def index_array(values, limit=None):
+
+    # two bytes are enough for most of pages
+    values = list(values)
+    limit = max(values or [0]) if limit == None else limit
+
+    return array('H' if limit < 65536 else 'I', values)
+
+class PageLayout(object):
+    '''
+    Words, lines and paragraphs of one page in the reading order.
+
+    The layout is stored in parallel arrays to keep layouts of whole
+    documents in memory. Words have only horizontal positions, their
+    vertical positions are given by their lines. The text is stored
+    in UTF-8 and words point to it by byte offsets.
+
+    A page with 2500 chars, 400 words and 50 lines in 10 paragraphs
+    takes about 9 kB, so layouts of 1000 such pages take about 9 MB.
+    '''
+
+    __slots__ = ('width', 'height', 'text', 'columns',
+                 'word_x1', 'word_x2', 'word_start', 'word_end', 'word_line',
+                 'line_x1', 'line_y1', 'line_x2', 'line_y2', 'line_first', 'line_end',
+                 'line_paragraph', 'line_order',
+                 'paragraph_lines', 'paragraph_start')
+
+    def __init__(self, builder):
+
+        self.width = builder.width
+        self.height = builder.height
+
+        # text of page in UTF-8 and offsets of chars
+        offsets = [0]
+
+        for char in builder.text:
+            offsets.append(offsets[-1] + len(char.encode('utf-8')))
+
+        self.text = builder.text.encode('utf-8')
+
+        # words
+        words = builder.words
+
+        self.word_x1 = array('f', [w[0] for w in words])
+        self.word_x2 = array('f', [w[2] for w in words])
+        self.word_start = index_array((offsets[w[4]] for w in words), len(self.text))
+        self.word_end = index_array((offsets[w[5]] for w in words), len(self.text))
+        self.word_line = index_array((w[6] for w in words), len(builder.lines))
+
+        # lines
+        lines = builder.lines
+
+        self.line_x1 = array('f', [l[0] for l in lines])
+        self.line_y1 = array('f', [l[1] for l in lines])
+        self.line_x2 = array('f', [l[2] for l in lines])
+        self.line_y2 = array('f', [l[3] for l in lines])
+        self.line_first = index_array((l[4] for l in lines), len(words))
+        self.line_end = index_array((l[5] for l in lines), len(words))
+
+        # paragraphs as lines in the reading order
+        self.paragraph_lines = index_array((i for p in builder.paragraphs for i in p), len(lines))
+        self.paragraph_start = index_array([0], len(lines))
+
+        for paragraph in builder.paragraphs:
+            self.paragraph_start.append(self.paragraph_start[-1] + len(paragraph))
+
+        # line -> paragraph, line -> position in the reading order
+        line_paragraph = [0] * len(lines)
+        line_order = [0] * len(lines)
+
+        for index in range(len(builder.paragraphs)):
+            for position in range(self.paragraph_start[index], self.paragraph_start[index + 1]):
+                line_paragraph[self.paragraph_lines[position]] = index
+                line_order[self.paragraph_lines[position]] = position
+
+        self.line_paragraph = index_array(line_paragraph, len(builder.paragraphs))
+        self.line_order = index_array(line_order, len(lines))
+
+        # columns
+        self.columns = tuple(builder.columns)
+
+    @classmethod
+    def from_chars(cls, text, rects, width, height):
+
+        return cls(LayoutBuilder.from_chars(text, rects, width, height))
+
+    @classmethod
+    def from_lines(cls, lines, width, height):
+
+        return cls(LayoutBuilder.from_lines(lines, width, height))
+
+    @classmethod
+    def from_words(cls, lines, width, height):
+
+        return cls(LayoutBuilder.from_words(lines, width, height))
+
+    def is_empty(self):
+
+        return not len(self.word_x1)
+
+    def get_size(self):
+
+        # memory taken by arrays and text
+        size = len(self.text)
+
+        for name in self.__slots__:
+            value = getattr(self, name)
+
+            if isinstance(value, array):
+                size += value.itemsize * len(value)
+
+        return size
+
+    def get_paragraphs_count(self):
+
+        return len(self.paragraph_start) - 1
+
+    def get_word_text(self, word):
+
+        return self.text[self.word_start[word]:self.word_end[word]].decode('utf-8')
+
+    def get_line_box(self, line):
+
+        return (self.line_x1[line], self.line_y1[line], self.line_x2[line], self.line_y2[line])
+
+    def get_line_text(self, line, words=None):
+
+        if words == None :
+            words = range(self.line_first[line], self.line_end[line])
+
+        return u' '.join(self.get_word_text(w) for w in words)
+
+    def get_paragraph_lines(self, paragraph):
+
+        return self.paragraph_lines[self.paragraph_start[paragraph]:self.paragraph_start[paragraph + 1]]
+
+    def join_lines(self, lines):
+
+        result = u''
+
+        for line in lines :
+
+            # join hyphenated words
+            if result.endswith(u'-') :
+                result = result[:-1] + line
+            elif result :
+                result = result + u' ' + line
+            else :
+                result = line
+
+        return result
+
+    def as_numpy(self, values):
+
+        # view of array without copying
+        return numpy.frombuffer(values, dtype=values.typecode)
+
+    def find_line_at(self, x, y):
+
+        if len(self.line_x1) and numpy.is_available() :
+            return self.find_line_at_numpy(x, y)
+
+        for line in range(len(self.line_x1)):
+            if self.line_x1[line] <= x and self.line_y1[line] <= y \
+               and self.line_x2[line] >= x and self.line_y2[line] >= y :
+                return line
+
+        return None
+
+    def find_line_at_numpy(self, x, y):
+
+        # test all lines at once
+        hits = numpy.flatnonzero((self.as_numpy(self.line_x1) <= x)
+                               & (self.as_numpy(self.line_y1) <= y)
+                               & (self.as_numpy(self.line_x2) >= x)
+                               & (self.as_numpy(self.line_y2) >= y))
+
+        if not len(hits) :
+            return None
+
+        return int(hits[0])
+
+    def find_line(self, x, y):
+
+        line = self.find_line_at(x, y)
+
+        # nothing found
+        if line == None :
+            return None, list()
+
+        return self.get_line_text(line), [self.get_line_box(line)]
+
+    def find_paragraph(self, x, y):
+
+        line = self.find_line_at(x, y)
+
+        # nothing found
+        if line == None :
+            return None, list()
+
+        lines = self.get_paragraph_lines(self.line_paragraph[line])
+
+        text = self.join_lines(self.get_line_text(i) for i in lines)
+        areas = [self.get_line_box(i) for i in lines]
+
+        return text, areas
+
+    def find_words(self, x1, y1, x2, y2):
+
+        if len(self.word_x1) and numpy.is_available() :
+            return [int(word) for word in self.find_words_numpy(x1, y1, x2, y2)]
+
+        words = list()
+
+        for word in range(len(self.word_x1)):
+            line = self.word_line[word]
+
+            if self.word_x1[word] <= x2 and self.line_y1[line] <= y2 \
+               and self.word_x2[word] >= x1 and self.line_y2[line] >= y1 :
+                words.append(word)
+
+        return words
+
+    def find_words_numpy(self, x1, y1, x2, y2):
+
+        # lines in the area
+        line_hits = (self.as_numpy(self.line_y1) <= y2) & (self.as_numpy(self.line_y2) >= y1)
+
+        # test all words at once
+        return numpy.flatnonzero(line_hits[self.as_numpy(self.word_line)]
+                                 & (self.as_numpy(self.word_x1) <= x2)
+                                 & (self.as_numpy(self.word_x2) >= x1))
+
+    def find_text(self, x1, y1, x2, y2):
+
+        if len(self.word_x1) and numpy.is_available() :
+            return self.find_text_numpy(x1, y1, x2, y2)
+
+        # find words in the area
+        selected = dict()
+
+        for word in self.find_words(x1, y1, x2, y2):
+            selected.setdefault(self.word_line[word], list()).append(word)
+
+        return self.get_selection(selected)
+
+    def find_text_numpy(self, x1, y1, x2, y2):
+
+        word_line = self.as_numpy(self.word_line)
+        hits = self.find_words_numpy(x1, y1, x2, y2)
+
+        # nothing found
+        if not len(hits) :
+            return None, list()
+
+        # words are ordered by lines, so split them where the line changes
+        lines = word_line[hits]
+        starts = numpy.concatenate(([0], numpy.flatnonzero(numpy.diff(lines)) + 1))
+
+        selected = dict((int(lines[start]), [int(w) for w in words])
+                        for start, words in zip(starts, numpy.split(hits, starts[1:])))
+
+        return self.get_selection(selected)
+
+    def find_table(self, x1, y1, x2, y2):
+        '''
+        Returns rows of cells of table in the area and areas of cells.
+        Words are grouped to rows by their vertical positions and to
+        cells by gaps between them. Columns are given by the rows
+        with the most cells.
+        '''
+        words = self.find_words(x1, y1, x2, y2)
+
+        # nothing found
+        if not words :
+            return None, list()
+
+        # words from top to bottom
+        boxes = [(self.word_x1[w], self.line_y1[self.word_line[w]],
+                  self.word_x2[w], self.line_y2[self.word_line[w]], w) for w in words]
+        boxes.sort(key=lambda box: box[1] + box[3])
+
+        # rows of words with overlapping lines
+        rows = list()
+
+        for box in boxes :
+            if rows and (box[1] + box[3]) / 2.0 <= rows[-1][0] :
+                rows[-1][0] = max(rows[-1][0], box[3])
+                rows[-1][1].append(box)
+            else :
+                rows.append([box[3], [box]])
+
+        # cells of words separated by small gaps
+        table = [self.split_row(row) for bottom, row in rows]
+        columns = self.get_columns(table)
+        starts = [column[0] for column in columns]
+
+        result = list()
+        areas = list()
+
+        for cells in table :
+            texts = [list() for column in columns]
+
+            for cell in cells :
+                texts[self.get_cell_column(cell, columns, starts)].append(cell[4])
+                areas.append(tuple(cell[:4]))
+
+            result.append([u' '.join(text) for text in texts])
+
+        return result, areas
+
+    def split_row(self, row):
+
+        row.sort()
+        cells = list()
+
+        for x1, y1, x2, y2, word in row :
+            text = self.get_word_text(word)
+
+            # continue the cell
+            if cells and x1 - cells[-1][2] <= CELL_GAP * (y2 - y1) :
+                cell = cells[-1]
+                cells[-1] = [cell[0], min(cell[1], y1), max(cell[2], x2), max(cell[3], y2), cell[4] + u' ' + text]
+            else :
+                cells.append([x1, y1, x2, y2, text])
+
+        return cells
+
+    def get_columns(self, table):
+
+        # rows with the most cells are not spanned
+        count = max(len(cells) for cells in table)
+        columns = list()
+
+        for cells in table :
+            if len(cells) != count :
+                continue
+
+            for index, cell in enumerate(cells):
+                if len(columns) <= index :
+                    columns.append([cell[0], cell[2]])
+                else :
+                    columns[index] = [min(columns[index][0], cell[0]), max(columns[index][1], cell[2])]
+
+        return columns
+
+    def get_cell_column(self, cell, columns, starts):
+
+        # the last column starting before the cell
+        index = max(0, bisect_right(starts, cell[0]) - 1)
+
+        # or the next one, if it is nearer
+        if index + 1 < len(columns) and cell[0] > columns[index][1] \
+           and starts[index + 1] - cell[0] < cell[0] - columns[index][1] :
+            index += 1
+
+        return index
+
+    def get_selection(self, selected):
+
+        # nothing found
+        if not selected :
+            return None, list()
+
+        # lines in the reading order
+        lines = sorted(selected, key=lambda line: self.line_order[line])
+
+        text = self.join_lines(self.get_line_text(line, selected[line]) for line in lines)
+        areas = list()
+
+        for line in lines :
+            words = selected[line]
+            areas.append((min(self.word_x1[w] for w in words), self.line_y1[line],
+                          max(self.word_x2[w] for w in words), self.line_y2[line]))
+
+        return text, areas
+
+class LayoutBuilder(object):
+    '''
+    Finds lines, paragraphs and columns of page from positions of words.
+    '''
+
+    # blocks wider than this part of page span all columns
+    SPANNING = 0.6
+
+    def __init__(self, width, height):
+
+        self.width = width
+        self.height = height
+
+        # text of page
+        self.text = u''
+
+        # words as (x1, y1, x2, y2, start, end, line),
+        # where start and end are offsets in text
+        self.words = list()
+
+        # lines as [x1, y1, x2, y2, first word, end word]
+        self.lines = list()
+
+        # paragraphs as lists of lines in the reading order
+        self.paragraphs = list()
+
+        # columns as (x1, x2)
+        self.columns = list()
+
+        # words of the unfinished line
+        self.line_start = 0
+
+    @classmethod
+    def from_chars(cls, text, rects, width, height):
+
+        builder = cls(width, height)
+        builder.text = text = decode_text(text)
+
+        word = None
+
+        for i, char in enumerate(text):
+
+            # end of word
+            if char.isspace():
+
+                if word :
+                    builder.add_word(*word)
+                    word = None
+
+                # end of line
+                if char == '\n':
+                    builder.end_line()
+
+                continue
+
+            x1, y1, x2, y2 = rects[i]
+
+            # start of word
+            if not word :
+                word = [x1, y1, x2, y2, i, i + 1]
+
+            # extend word
+            else :
+                word[0] = min(word[0], x1)
+                word[1] = min(word[1], y1)
+                word[2] = max(word[2], x2)
+                word[3] = max(word[3], y2)
+                word[5] = i + 1
+
+        if word :
+            builder.add_word(*word)
+
+        builder.end_line()
+        builder.analyse()
+
+        return builder
+
+    @classmethod
+    def from_lines(cls, lines, width, height):
+
+        builder = cls(width, height)
+        parts = list()
+        offset = 0
+
+        for text, (x1, y1, x2, y2) in lines:
+
+            text = decode_text(text)
+
+            # words get the width according to the number of chars
+            size = (x2 - x1) / float(max(len(text), 1))
+            start = None
+
+            for i, char in enumerate(text + ' '):
+
+                if not char.isspace() and start == None :
+                    start = i
+
+                elif char.isspace() and start != None :
+                    builder.add_word(x1 + start * size, y1, x1 + i * size, y2,
+                                     offset + start, offset + i)
+                    start = None
+
+            builder.end_line()
+
+            parts.append(text)
+            offset += len(text) + 1
+
+        builder.text = u'\n'.join(parts)
+        builder.analyse()
+
+        return builder
+
+    @classmethod
+    def from_words(cls, lines, width, height):
+
+        builder = cls(width, height)
+        parts = list()
+        offset = 0
+
+        # lines as lists of (text, box) of words
+        for words in lines:
+
+            for text, (x1, y1, x2, y2) in words:
+                text = decode_text(text)
+                builder.add_word(x1, y1, x2, y2, offset, offset + len(text))
+                parts.append(text + u' ')
+                offset += len(text) + 1
+
+            builder.end_line()
+
+            parts.append(u'\n')
+            offset += 1
+
+        builder.text = u''.join(parts)
+        builder.analyse()
+
+        return builder
+
+    def add_word(self, x1, y1, x2, y2, start, end):
+
+        # words not on the same line
+        if len(self.words) > self.line_start :
+            py1, py2 = self.words[-1][1], self.words[-1][3]
+
+            if y1 >= py2 or y2 <= py1 :
+                self.end_line()
+
+        self.words.append((x1, y1, x2, y2, start, end, len(self.lines)))
+
+    def end_line(self):
+
+        # empty line
+        if len(self.words) == self.line_start :
+            return
+
+        words = self.words[self.line_start:]
+
+        self.lines.append([min(w[0] for w in words),
+                           min(w[1] for w in words),
+                           max(w[2] for w in words),
+                           max(w[3] for w in words),
+                           self.line_start,
+                           len(self.words)])
+
+        self.line_start = len(self.words)
+
+    def analyse(self):
+
+        blocks = self.find_blocks()
+        ordered = self.order_blocks(blocks)
+
+        # split blocks to paragraphs
+        for block in ordered :
+            self.paragraphs.extend(self.split_block(block))
+
+        logger.debug('PDF Notes: found %s lines, %s paragraphs, %s columns',
+                     len(self.lines), len(self.paragraphs), len(self.columns))
+
+    def find_blocks(self):
+
+        blocks = list()
+
+        for index, line in enumerate(self.lines):
+
+            # join line with the last block
+            if blocks and self.continues_block(blocks[-1], line) :
+                blocks[-1].append(index)
+
+            # start new block
+            else :
+                blocks.append([index])
+
+        return blocks
+
+    def continues_block(self, block, line):
+
+        last = self.lines[block[-1]]
+
+        height = line[3] - line[1]
+        last_height = last[3] - last[1]
+
+        # different font size
+        if abs(height - last_height) > 0.3 * max(height, last_height) :
+            return False
+
+        # too far or not below
+        gap = line[1] - last[3]
+
+        if gap < -0.5 * height or gap > 0.8 * height :
+            return False
+
+        # no horizontal overlap
+        x1, x2 = self.get_extent(block)
+
+        return line[0] < x2 and line[2] > x1
+
+    def get_extent(self, block):
+
+        return min(self.lines[i][0] for i in block), \
+               max(self.lines[i][2] for i in block)
+
+    def order_blocks(self, blocks):
+
+        spanning = list()
+        others = list()
+
+        # find blocks spanning all columns
+        for block in blocks :
+            x1, x2 = self.get_extent(block)
+
+            if x2 - x1 > self.SPANNING * self.width :
+                spanning.append(block)
+            else :
+                others.append(block)
+
+        # find columns
+        for x1, x2 in sorted(self.get_extent(block) for block in others):
+
+            if self.columns and x1 < self.columns[-1][1] :
+                self.columns[-1] = (self.columns[-1][0], max(x2, self.columns[-1][1]))
+            else :
+                self.columns.append((x1, x2))
+
+        # spanning blocks split page to sections
+        top = lambda block: self.lines[block[0]][1]
+        spanning.sort(key=top)
+
+        sections = [list() for i in range(len(spanning) + 1)]
+
+        for block in others :
+            section = 0
+
+            while section < len(spanning) and top(spanning[section]) <= top(block) :
+                section += 1
+
+            sections[section].append(block)
+
+        # sections from top to bottom, columns from left to right
+        ordered = list()
+
+        for section, blocks in enumerate(sections):
+
+            if section > 0 :
+                ordered.append(spanning[section - 1])
+
+            blocks.sort(key=lambda block: (self.get_column(block), top(block)))
+            ordered.extend(blocks)
+
+        return ordered
+
+    def get_column(self, block):
+
+        x1, x2 = self.get_extent(block)
+
+        for index, (c1, c2) in enumerate(self.columns):
+            if c1 <= x1 and x2 <= c2 :
+                return index
+
+        return 0
+
+    def split_block(self, block):
+
+        paragraphs = list()
+        x1, x2 = self.get_extent(block)
+        previous = None
+
+        for index in block :
+            line = self.lines[index]
+            height = line[3] - line[1]
+
+            # new paragraph after a short line or before an indented line
+            if previous == None \
+               or previous[2] < x2 - 2 * height \
+               or line[0] > x1 + height :
+                paragraphs.append(list())
+
+            paragraphs[-1].append(index)
+            previous = line
+
+        return paragraphs
+
+# end of file layout.py
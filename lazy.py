@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+
+# Author: Vendula Poncova <poncovka@gmail.com>
+# File: lazy.py
+#
+# Description:
+# Modules imported on the first use.
+#
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+class LazyModule(object):
+    '''
+    Module imported on the first access to its attributes.
+    '''
+    def __init__(self, name):
+
+        self._name = name
+        self._module = None
+        self._available = None
+
+    def _load(self):
+
+        if self._module == None :
+            logger.debug('PDF Notes: importing %s', self._name)
+            self._module = __import__(self._name)
+
+        return self._module
+
+    def is_available(self):
+
+        # try to import the module only once
+        if self._available == None :
+            try:
+                self._load()
+                self._available = True
+            except ImportError:
+                self._available = False
+
+        return self._available
+
+    def __getattr__(self, attr):
+
+        # keep the attribute, so the next access is direct
+        value = getattr(self._load(), attr)
+        setattr(self, attr, value)
+
+        return value
+
+# end of file lazy.py
@@ -7,8 +7,33 @@
 # Model of PDF document.
 #
 
-import poppler
+import os
+import json
 import logging
+import hashlib
+
+from .layout import PageLayout, decode_text
+from .lazy import LazyModule
+from .cache import get_ocr_path
+
+# depends on python-poppler package, imported with the first document
+poppler = LazyModule('poppler')
+cairo = LazyModule('cairo')
+
+# width in px of page rendered for its fingerprint
+FINGERPRINT_WIDTH = 32
+
+# size in bytes of blocks of file read for its hash
+HASH_BLOCK = 1024 * 1024
+
+# number of pages of reloaded file compared at once
+VERIFY_PAGES = 5
+
+# types of annotations which are not notes of readers
+IGNORED_ANNOTS = ('link', 'popup', 'widget', 'unknown')
+
+# max inset in pt of areas of annotations
+ANNOT_INSET = 3
 
 logger = logging.getLogger(__name__)
 
@@ -27,6 +52,13 @@ class PDFDocument(object):
         self.pages_count = 0
         self.width = 0
         self.height = 0
+        self.layouts = dict()
+        self.images = dict()
+        self.fingerprints = dict()
+        self.unverified = set()
+        self.ocr_pages = set()
+        self.file_hash = None
+        self.hashing = None
      
     def exists(self):
         return self.document != None 
@@ -52,8 +84,6 @@ class PDFDocument(object):
             
             # set size
             self.width, self.height = self.page.get_size()
-            
-            self.walk()
                                   
             return True
         
@@ -74,6 +104,13 @@ class PDFDocument(object):
         self.file = file
         self.document = document
         self.pages_count = self.document.get_n_pages()
+        self.layouts = dict()
+        self.images = dict()
+        self.fingerprints = dict()
+        self.unverified = set()
+        self.ocr_pages = set()
+        self.file_hash = None
+        self.hashing = None
         
         self.set_page(0) 
       
@@ -191,15 +228,29 @@ class PDFDocument(object):
                 
         return areas
     
-    def render_page(self, cairo):
+    def get_page(self, page_number):
+        
+        # current page
+        if page_number == self.page_number :
+            return self.page
+        
+        return self.document.get_page(page_number)
+    
+    def render_page(self, cairo, page=None):
+        
+        # current page by default
+        if page == None :
+            page = self.page
+        
+        width, height = page.get_size()
  
         # white background       
         cairo.set_source_rgb(1, 1, 1)
-        cairo.rectangle(0, 0, self.width, self.height)
+        cairo.rectangle(0, 0, width, height)
         cairo.fill()
         
         # rendering
-        self.page.render(cairo)
+        page.render(cairo)
             
     def render_selection(self, cairo, color, *area):
         logger.debug('PDF Notes: rendering selection')
@@ -219,7 +270,394 @@ class PDFDocument(object):
                                    background_color
                                    )            
 
-    def walk(self):
-        pass
+    def get_images(self, page=None):
+        
+        # current page by default
+        if page == None :
+            page = self.page
+        
+        page_number = page.get_index()
+        self.verify_page(page_number)
+        
+        # index images of page
+        if page_number not in self.images :
+            
+            # areas of images are in the same coordinates as the page
+            self.images[page_number] = [(mapping.image_id, self.to_tuple(mapping.area)) 
+                                        for mapping in page.get_image_mapping()]
+            
+            logger.debug('PDF Notes: found %s images on page %s', 
+                         len(self.images[page_number]), page_number)
+            
+        return self.images[page_number]
+    
+    def find_image(self, x, y, page=None):
+        
+        # find the image at the point
+        for image_id, area in self.get_images(page):
+            if self.point_in_rect(x, y, self.to_rect(*area)) :
+                return image_id, area
+        
+        return None, None
+    
+    def find_image_in(self, x1, y1, x2, y2, page=None):
+        
+        selection = self.to_rect(x1, y1, x2, y2)
+        size = abs(x2 - x1) * abs(y2 - y1)
+        
+        # find the image, which is covered by the selection 
+        # and which covers most of the selection
+        for image_id, area in self.get_images(page):
+            
+            intersection = self.rect_intersection(self.to_rect(*area), selection)
+            
+            if not intersection :
+                continue
+            
+            ix1, iy1, ix2, iy2 = intersection
+            image_size = (area[2] - area[0]) * (area[3] - area[1])
+            common = (ix2 - ix1) * (iy2 - iy1)
+            
+            if common >= 0.95 * image_size and common >= 0.9 * size :
+                return image_id, area
+            
+        return None, None
+    
+    def get_image(self, image_id, page=None):
+        
+        # current page by default
+        if page == None :
+            page = self.page
+        
+        # surface with the image in its own resolution
+        return page.get_image(image_id)
+    
+    def get_annotations(self, page_number):
+        '''
+        Returns list of annotations of page as tuples (kind, areas, contents,
+        author). Kind is the nick of poppler annotation type, areas are in
+        the coordinates of page, text markups have area for each quad.
+        '''
+        page = self.get_page(page_number)
+        width, height = page.get_size()
+        annotations = list()
+        
+        for mapping in page.get_annot_mapping():
+            
+            annot = mapping.annot
+            kind = annot.get_annot_type().value_nick
+            
+            # not written by readers
+            if kind in IGNORED_ANNOTS :
+                continue
+            
+            # areas of annotations are upside down
+            areas = [(mapping.area.x1, height - mapping.area.y2, mapping.area.x2, height - mapping.area.y1)]
+            
+            # marked quads of text, if the bindings provide them
+            if hasattr(annot, 'get_quadrilaterals') :
+                areas = [self.quad_to_area(quad, height) for quad in annot.get_quadrilaterals()] or areas
+            
+            contents = annot.get_contents() or u''
+            author = annot.get_label() if hasattr(annot, 'get_label') else None
+            
+            annotations.append((kind, areas, contents.decode('utf-8'), (author or '').decode('utf-8')))
+        
+        logger.debug('PDF Notes: found %s annotations on page %s', len(annotations), page_number)
+        return annotations
+    
+    def quad_to_area(self, quad, height):
+        
+        xs = (quad.p1.x, quad.p2.x, quad.p3.x, quad.p4.x)
+        ys = (quad.p1.y, quad.p2.y, quad.p3.y, quad.p4.y)
+        
+        return (min(xs), height - max(ys), max(xs), height - min(ys))
+    
+    def get_annotated_text(self, page_number, areas):
+        
+        layout = self.create_layout(page_number)
+        texts = list()
+        
+        for x1, y1, x2, y2 in areas :
+            
+            # marked areas overlap the neighbouring lines and words
+            dy = min(ANNOT_INSET, (y2 - y1) / 4.0)
+            text, found = layout.find_text(x1 + 1, y1 + dy, x2 - 1, y2 - dy)
+            
+            if text :
+                texts.append(text)
+        
+        return layout.join_lines(texts)
+    
+    def get_layout(self, page_number=None):
+        
+        # current page by default
+        if page_number == None :
+            page_number = self.page_number
+        
+        self.verify_page(page_number)
+        return self.layouts.get(page_number)
+    
+    def create_layout(self, page_number=None):
+        
+        # current page by default
+        if page_number == None :
+            page_number = self.page_number
+        
+        # already created
+        if self.get_layout(page_number) :
+            return self.layouts[page_number]
+        
+        logger.debug('PDF Notes: creating layout of page %s', page_number)
+        
+        page = self.get_page(page_number)
+        width, height = page.get_size()
+        
+        # positions of all chars
+        if hasattr(page, 'get_text_layout') :
+            layout = PageLayout.from_chars(*self.get_chars(page, width, height))
+        
+        # positions of lines
+        else :
+            layout = PageLayout.from_lines(self.get_lines(page, width, height), width, height)
+        
+        self.layouts[page_number] = layout
+        return layout
+    
+    def get_file_hash(self):
+        
+        # hash of the content of file, finish the running hashing
+        if self.file_hash == None :
+            for block in self.hash_file():
+                pass
+            
+        return self.file_hash
+    
+    def hash_file(self):
+        '''
+        Returns generator, which computes hash of the content of file
+        block by block and yields after each block. The running hashing
+        is continued, not started again.
+        '''
+        if self.hashing == None :
+            self.hashing = self.hash_blocks()
+        
+        return self.hashing
+    
+    def hash_blocks(self):
+        
+        digest = hashlib.sha1()
+        
+        # the next hashing starts again
+        try:
+            with open(self.file.path, 'rb') as f:
+                for block in iter(lambda: f.read(HASH_BLOCK), ''):
+                    digest.update(block)
+                    yield
+        except Exception:
+            self.hashing = None
+            raise
+        
+        self.file_hash = digest.hexdigest()
+        self.hashing = None
+    
+    def load_ocr(self, page_number):
+        '''
+        Replaces layout of page by recognized text from cache.
+        The file must be hashed. Returns the layout or None.
+        '''
+        path = get_ocr_path(self.file_hash, page_number)
+        
+        # not recognized yet
+        if not os.path.exists(path) :
+            return None
+        
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except Exception:
+            logger.exception('PDF Notes: cannot load recognized text')
+            return None
+            
+        layout = PageLayout.from_words(data['lines'], data['width'], data['height'])
+        
+        self.layouts[page_number] = layout
+        self.ocr_pages.add(page_number)
+        
+        return layout
+        
+    def set_ocr(self, page_number, lines):
+        
+        page = self.get_page(page_number)
+        width, height = page.get_size()
+        
+        # save recognized text, so the page is recognized only once
+        with open(get_ocr_path(self.file_hash, page_number), 'w') as f:
+            json.dump({'width': width, 'height': height, 'lines': lines}, f)
+        
+        # replace the empty layout
+        self.layouts[page_number] = PageLayout.from_words(lines, width, height)
+        self.ocr_pages.add(page_number)
+        
+    def is_scanned(self, page_number=None):
+        
+        # current page by default
+        if page_number == None :
+            page_number = self.page_number
+        
+        return page_number in self.ocr_pages
+    
+    def get_pages_without_fingerprint(self):
+        
+        # pages with data, which cannot be compared after reloading
+        return set(self.layouts).union(self.images).difference(self.fingerprints)
+    
+    def add_fingerprint(self, page_number):
+        
+        # remember the content of page to find its changes
+        self.fingerprints[page_number] = self.get_fingerprint(self.get_page(page_number))
+    
+    def get_fingerprint(self, page):
+        
+        width, height = page.get_size()
+        
+        # size, text and images
+        digest = hashlib.sha1(repr((width, height)))
+        digest.update(self.get_text(page).encode('utf-8'))
+        digest.update(repr([self.to_tuple(m.area) for m in page.get_image_mapping()]))
+        
+        # tiny render for changes of graphics
+        scale = FINGERPRINT_WIDTH / float(width)
+        surface = cairo.ImageSurface(cairo.FORMAT_RGB24, FINGERPRINT_WIDTH, max(1, int(height * scale)))
+        context = cairo.Context(surface)
+        context.scale(scale, scale)
+        self.render_page(context, page)
+        surface.flush()
+        digest.update(str(surface.get_data()))
+        
+        return digest.hexdigest()
+    
+    def reload(self):
+        logger.info('PDF Notes: reloading file %s', self.file)
+        
+        # open file again
+        try:      
+            document = poppler.document_new_from_file ("file://" + self.file.path, None)
+        except Exception:
+            logger.exception("PDF Notes: cannot reload file")
+            return None
+        
+        count = document.get_n_pages()
+        
+        # probably not written completely
+        if not count :
+            logger.debug('PDF Notes: no pages to reload')
+            return None
+        
+        # removed pages and pages with data but without fingerprint
+        changed = set(n for n in self.fingerprints if n >= count)
+        changed.update(self.get_pages_without_fingerprint())
+        
+        # other pages are compared when they are used
+        self.unverified = set(n for n in self.fingerprints if n < count)
+        
+        # update state, keep the current page
+        self.file_hash = None
+        self.hashing = None
+        self.document = document
+        self.pages_count = count
+        self.page_number = min(self.page_number, count - 1)
+        
+        self.page = self.document.get_page(self.page_number)
+        self.width, self.height = self.page.get_size()
+        
+        # the current page is shown now
+        if self.page_number not in self.fingerprints or self.verify_page(self.page_number) :
+            changed.add(self.page_number)
+        
+        for page_number in changed :
+            self.forget_page(page_number)
+        
+        logger.debug('PDF Notes: changed pages %s', sorted(changed))
+        return changed
+    
+    def verify_page(self, page_number):
+        '''
+        Compares page of reloaded file with its fingerprint and forgets
+        its data, if it changed. Returns True for changed page.
+        '''
+        if page_number not in self.unverified :
+            return False
+        
+        self.unverified.discard(page_number)
+        
+        if self.get_fingerprint(self.get_page(page_number)) == self.fingerprints.get(page_number) :
+            return False
+        
+        logger.debug('PDF Notes: page %s changed', page_number)
+        self.forget_page(page_number)
+        
+        return True
+    
+    def verify_pages(self, count=VERIFY_PAGES):
+        
+        # some of pages, which were not used since reloading
+        pages = sorted(self.unverified)[:count]
+        
+        return set(n for n in pages if self.verify_page(n))
+    
+    def forget_page(self, page_number):
+        
+        self.layouts.pop(page_number, None)
+        self.images.pop(page_number, None)
+        self.fingerprints.pop(page_number, None)
+        self.unverified.discard(page_number)
+        self.ocr_pages.discard(page_number)
+    
+    def get_chars(self, page, width, height):
+        
+        # chars of text match rects, not bytes
+        text = decode_text(page.get_text())
+        rects = page.get_text_layout()
+        
+        # some bindings return also the result
+        if isinstance(rects, tuple) :
+            rects = rects[-1]
+        
+        rects = [self.to_tuple(rect) for rect in rects]
+        
+        return text, rects, width, height
+    
+    def get_text(self, page):
+        
+        width, height = page.get_size()
+        
+        # get all text of page
+        style = poppler.SELECTION_LINE
+        selection = self.to_rect(0, 0, width, height)
+        
+        return decode_text(page.get_selected_text(style, selection))
+    
+    def get_lines(self, page, width, height):
+        
+        text = self.get_text(page)
+        
+        lines = list()
+        found = dict()
+        
+        # find positions of lines in order of their occurrences
+        for line in text.splitlines():
+            
+            if not line.strip() :
+                continue
+            
+            if line not in found :
+                found[line] = [(rect.x1, height - rect.y2, rect.x2, height - rect.y1) 
+                               for rect in page.find_text(line)]
+                
+            if found[line] :
+                lines.append((line, found[line].pop(0)))
+        
+        return lines
 
 # end of file model.py       
\ No newline at end of file
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+
+# Author: Vendula Poncova <poncovka@gmail.com>
+# File: ocr.py
+#
+# Description:
+# Recognition of text on scanned pages with Tesseract.
+#
+
+import os
+import sys
+import gobject
+import logging
+import tempfile
+import subprocess
+import multiprocessing
+
+from collections import OrderedDict
+from distutils.spawn import find_executable
+
+logger = logging.getLogger(__name__)
+
+# resolution of pages rendered for recognition
+OCR_DPI = 300
+
+def has_tesseract():
+
+    # pages are rendered for tesseract by pdftoppm from poppler-utils
+    return find_executable('tesseract') != None and find_executable('pdftoppm') != None
+
+def parse_tsv(data, scale):
+
+    lines = OrderedDict()
+
+    # words are rows of level 5
+    for row in data.splitlines()[1:]:
+
+        fields = row.split('\t')
+
+        if len(fields) < 12 or fields[0] != '5' :
+            continue
+
+        text = fields[11].decode('utf-8').strip()
+
+        if not text :
+            continue
+
+        # box in page coordinates
+        left, top, width, height = [int(value) for value in fields[6:10]]
+        box = (left / scale, top / scale, (left + width) / scale, (top + height) / scale)
+
+        # group words by page, block, paragraph and line
+        lines.setdefault(tuple(fields[1:5]), list()).append((text, box))
+
+    return list(lines.values())
+
+class OCRPool(object):
+    '''
+    Runs Tesseract for pages in background processes. Pages are
+    rendered to images by pdftoppm, which writes them to the input
+    of Tesseract, so the main loop only starts the processes.
+    '''
+    def __init__(self, workers=None):
+
+        self.count = workers or multiprocessing.cpu_count()
+        self.queue = list()
+        self.running = dict()
+        self.pending = set()
+        self.failed = set()
+
+    def recognize(self, key, path, page_number, callback, needed=None):
+        '''
+        Recognizes text of page of PDF file identified by key. Function
+        needed() returns False, if the page is not needed anymore. Function
+        callback(key, lines) gets lines of words or None.
+        '''
+        # already queued or running, or failed before
+        if key in self.pending or key in self.failed :
+            return
+
+        self.pending.add(key)
+        self.queue.append((key, path, page_number, callback, needed))
+        self.start()
+
+    def start(self):
+
+        while self.queue and len(self.running) < self.count :
+
+            key, path, page_number, callback, needed = self.queue.pop(0)
+
+            # the page is not needed anymore
+            if needed != None and not needed() :
+                self.pending.discard(key)
+                continue
+
+            logger.debug('PDF Notes: recognizing text of %s', key)
+
+            # tesseract writes the output to base.tsv
+            fd, base = tempfile.mkstemp(prefix='pdfnotes-')
+            os.close(fd)
+            os.unlink(base)
+
+            # arguments of processes are bytes
+            if isinstance(path, unicode) :
+                path = path.encode(sys.getfilesystemencoding() or 'utf-8')
+
+            # render page in high resolution and pipe it to tesseract
+            with open(os.devnull, 'w') as devnull:
+                render = subprocess.Popen(['pdftoppm', '-r', str(OCR_DPI), '-png',
+                                           '-f', str(page_number + 1), '-l', str(page_number + 1),
+                                           path], stdout=subprocess.PIPE, stderr=devnull)
+
+                process = subprocess.Popen(['tesseract', 'stdin', base, 'tsv'],
+                                           stdin=render.stdout, stdout=devnull, stderr=devnull)
+                render.stdout.close()
+
+            self.running[process.pid] = (process, render, key, base, callback)
+            gobject.child_watch_add(process.pid, self.on_exit)
+
+    def on_exit(self, pid, status):
+
+        process, render, key, base, callback = self.running.pop(pid)
+        self.pending.discard(key)
+        lines = None
+
+        # pdftoppm ends with the end of its output
+        render.wait()
+
+        # read the result
+        try:
+            with open(base + '.tsv') as f:
+                lines = parse_tsv(f.read(), OCR_DPI / 72.0)
+
+        # do not try the page again
+        except IOError:
+            logger.error('PDF Notes: recognition of %s failed with status %s, %s',
+                         key, render.returncode, status)
+            self.failed.add(key)
+
+        # remove file
+        if os.path.exists(base + '.tsv'):
+            os.unlink(base + '.tsv')
+
+        callback(key, lines)
+
+        # next pages
+        self.start()
+
+    def stop(self):
+
+        self.queue = list()
+
+        for process, render, key, base, callback in self.running.values():
+            process.kill()
+            render.kill()
+
+# end of file ocr.py
@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+
+# Author: Vendula Poncova <poncovka@gmail.com>
+# File: server.py
+#
+# Description:
+# Rendering of PDF pages in separate processes.
+#
+
+import os
+import mmap
+import cairo
+import gobject
+import logging
+import tempfile
+import itertools
+import multiprocessing
+
+logger = logging.getLogger(__name__)
+
+# directory for shared buffers, backed by memory if possible
+SHARED_DIR = '/dev/shm' if os.path.isdir('/dev/shm') else None
+
+def serve(connection):
+    '''
+    Main loop of worker process. Worker keeps its own poppler
+    documents and renders pages into shared buffers.
+    '''
+    import poppler
+
+    documents = dict()
+
+    while True:
+
+        try:
+            request = connection.recv()
+        except EOFError:
+            break
+
+        # stop worker
+        if request == None :
+            break
+
+        # forget document
+        if len(request) == 1 :
+            documents.pop(request[0], None)
+            continue
+
+        request_id, uri, page_number, scale, x, y, path, width, height = request
+
+        try:
+            # open document
+            if uri not in documents :
+                documents[uri] = poppler.document_new_from_file(uri, None)
+
+            page = documents[uri].get_page(page_number)
+
+            # render page into the shared buffer
+            with open(path, 'r+b') as f:
+                buffer = mmap.mmap(f.fileno(), width * 4 * height)
+
+            surface = cairo.ImageSurface.create_for_data(buffer, cairo.FORMAT_RGB24, width, height, width * 4)
+            context = cairo.Context(surface)
+            context.scale(scale, scale)
+            context.translate(-x, -y)
+
+            # white background
+            context.set_source_rgb(1, 1, 1)
+            context.paint()
+
+            page.render(context)
+            surface.flush()
+
+            del context, surface
+            buffer.close()
+
+            connection.send((request_id, None))
+
+        except Exception, e:
+            connection.send((request_id, str(e)))
+
+class RenderWorker(object):
+
+    def __init__(self, server):
+
+        self.server = server
+        self.requests = dict()
+
+        # start process
+        self.connection, child = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=serve, args=(child,))
+        self.process.daemon = True
+        self.process.start()
+        child.close()
+
+        # watch replies
+        self.watch = gobject.io_add_watch(self.connection.fileno(),
+                                          gobject.IO_IN | gobject.IO_HUP | gobject.IO_ERR,
+                                          self.on_reply)
+
+        logger.debug('PDF Notes: render worker %s started', self.process.pid)
+
+    def render(self, request_id, uri, page_number, scale, x, y, width, height, callback):
+
+        # create shared buffer
+        fd, path = tempfile.mkstemp(prefix='pdfnotes-', dir=SHARED_DIR)
+
+        try:
+            os.ftruncate(fd, width * 4 * height)
+            buffer = mmap.mmap(fd, width * 4 * height)
+        finally:
+            os.close(fd)
+
+        self.requests[request_id] = (path, buffer, width, height, callback)
+
+        # worker is dead, the request fails with the others
+        try:
+            self.connection.send((request_id, uri, page_number, scale, x, y, path, width, height))
+        except IOError:
+            self.on_crash()
+
+    def close_document(self, uri):
+
+        try:
+            self.connection.send((uri,))
+        except IOError:
+            self.on_crash()
+
+    def on_reply(self, source, condition):
+
+        # worker crashed
+        if not condition & gobject.IO_IN :
+            self.on_crash()
+            return False
+
+        try:
+            request_id, error = self.connection.recv()
+        except EOFError:
+            self.on_crash()
+            return False
+
+        path, buffer, width, height, callback = self.requests.pop(request_id)
+        os.unlink(path)
+
+        # failed
+        if error :
+            logger.error('PDF Notes: render worker failed: %s', error)
+            callback(None)
+
+        # surface over the shared buffer without copying
+        else :
+            callback(cairo.ImageSurface.create_for_data(buffer, cairo.FORMAT_RGB24, width, height, width * 4))
+
+        return True
+
+    def on_crash(self):
+        logger.error('PDF Notes: render worker %s crashed', self.process.pid)
+
+        # do not watch the dead worker
+        if self.watch != None :
+            gobject.source_remove(self.watch)
+            self.watch = None
+
+        self.connection.close()
+
+        # replace the worker before the requests are repeated
+        requests = self.requests
+        self.requests = dict()
+        self.server.on_worker_crash(self)
+
+        # report all requests as failed
+        for path, buffer, width, height, callback in requests.values():
+            os.unlink(path)
+            callback(None)
+
+    def stop(self):
+
+        if self.watch != None :
+            gobject.source_remove(self.watch)
+            self.watch = None
+
+        try:
+            self.connection.send(None)
+        except IOError:
+            pass
+
+        for path, buffer, width, height, callback in self.requests.values():
+            os.unlink(path)
+
+        self.requests = dict()
+        self.connection.close()
+
+class RenderServer(object):
+    '''
+    Pool of worker processes, which own poppler documents and render
+    pages into shared memory. A bad file can crash only the worker.
+    '''
+    def __init__(self, workers=None):
+
+        self.count = workers or multiprocessing.cpu_count()
+        self.workers = [RenderWorker(self) for i in range(self.count)]
+        self.ids = itertools.count()
+
+    def render(self, uri, page_number, scale, width, height, callback, x=0, y=0):
+        '''
+        Renders area of page of given size in pixels, which starts
+        at point x, y of the page, and calls callback(surface).
+        '''
+        # choose the least busy worker
+        worker = min(self.workers, key=lambda w: len(w.requests))
+        request_id = next(self.ids)
+
+        worker.render(request_id, uri, page_number, scale, x, y, width, height, callback)
+        return request_id
+
+    def close_document(self, uri):
+
+        # workers open the document again with the next request,
+        # crashed workers are replaced during the loop
+        for worker in list(self.workers) :
+            worker.close_document(uri)
+
+    def on_worker_crash(self, worker):
+
+        # replace the worker
+        self.workers.remove(worker)
+        self.workers.append(RenderWorker(self))
+
+    def stop(self):
+
+        for worker in self.workers :
+            worker.stop()
+
+        self.workers = list()
+
+# end of file server.py
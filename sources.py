@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+
+# Author: Vendula Poncova <poncovka@gmail.com>
+# File: sources.py
+#
+# Description:
+# Index of sources of notes inserted from PDF documents.
+#
+
+import os
+import json
+import hashlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+# scheme of links to sources, Zim opens other links as usual
+LINK_SCHEME = 'pdfnotes://'
+
+# name of index in the folder of notebook
+INDEX_NAME = '.pdfnotes-sources.json'
+
+def get_index_path(notebook):
+
+    # the index is moved with the notebook
+    if getattr(notebook, 'dir', None) != None :
+        return os.path.join(notebook.dir.path, INDEX_NAME)
+
+    # notebook without folder
+    return os.path.join(notebook.cache_dir.path, INDEX_NAME)
+
+def get_link(source_id):
+
+    return LINK_SCHEME + source_id
+
+def get_source_id(link):
+
+    if link and link.startswith(LINK_SCHEME) :
+        return link[len(LINK_SCHEME):].strip('/')
+
+    return None
+
+class SourceIndex(object):
+    '''
+    Places in PDF documents by ids used in links. Documents are
+    identified by hash of their content, so links survive moving
+    of files, which are opened from the last known path. Places in
+    files, which are not hashed yet, keep the path until the hash
+    is set. Changes are written by save().
+    '''
+    def __init__(self, path):
+
+        self.path = path
+        self.sources = dict()
+        self.files = dict()
+        self.dirty = False
+
+        if os.path.exists(path) :
+            try:
+                with open(path) as f:
+                    data = json.load(f)
+
+                self.sources = data.get('sources', {})
+                self.files = data.get('files', {})
+
+            except Exception:
+                logger.exception('PDF Notes: cannot load index of sources')
+
+    def add(self, file_hash, file_path, page_number, areas, kind):
+
+        source = {'hash' : file_hash,
+                  'page' : page_number,
+                  'area' : [[round(value, 2) for value in area] for area in areas],
+                  'kind' : kind,
+                  }
+
+        # file without hash yet
+        if file_hash == None :
+            source['path'] = file_path
+
+        # the same place has the same id
+        source_id = hashlib.sha1(json.dumps(source, sort_keys=True)).hexdigest()[:12]
+
+        self.sources[source_id] = source
+
+        if file_hash != None :
+            self.files[file_hash] = file_path
+
+        self.dirty = True
+
+        return source_id
+
+    def resolve(self, source_id):
+        '''
+        Returns path of document, page number, areas and kind of
+        selection for the id, or None.
+        '''
+        source = self.sources.get(source_id)
+
+        if source == None :
+            return None
+
+        # the last known path of file or the path without hash
+        path = self.files.get(source['hash'], source.get('path'))
+
+        return path, source['page'], \
+               [tuple(area) for area in source['area']], source['kind']
+
+    def get_hash(self, source_id):
+
+        return self.sources[source_id]['hash']
+
+    def set_hash(self, file_path, file_hash):
+
+        changed = False
+
+        # places in the file added before it was hashed
+        for source in self.sources.values():
+            if source['hash'] == None and source.get('path') == file_path :
+                source['hash'] = file_hash
+                del source['path']
+                changed = True
+
+        # the last known path of linked file
+        if changed or file_hash in self.files and self.files[file_hash] != file_path :
+            self.files[file_hash] = file_path
+            self.dirty = True
+
+    def save(self):
+
+        # nothing changed since the last save
+        if not self.dirty :
+            return
+
+        try:
+            with open(self.path, 'w') as f:
+                json.dump({'sources': self.sources, 'files': self.files}, f)
+
+            self.dirty = False
+
+        except Exception:
+            logger.exception('PDF Notes: cannot save index of sources')
+
+# end of file sources.py
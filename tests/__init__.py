@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+
+# Author: Vendula Poncova <poncovka@gmail.com>
+# File: tests/__init__.py
+#
+# Description:
+# Tests of modules of PDF Notes plugin, which do not need Zim.
+#
+# Usage:
+# python -m unittest discover -s tests -t .
+#
+
+import os
+import imp
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def load_package(name='pdfnotes'):
+
+    # the plugin as package without its __init__, which needs Zim
+    if name not in sys.modules :
+        package = imp.new_module(name)
+        package.__path__ = [ROOT]
+        sys.modules[name] = package
+
+    return sys.modules[name]
+
+load_package()
+
+# end of file tests/__init__.py
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+
+# Author: Vendula Poncova <poncovka@gmail.com>
+# File: tests/bench_import.py
+#
+# Description:
+# Measures the cost of the plugin at the start of Zim and lists
+# modules, which are loaded. Each measuring runs in a new interpreter.
+#
+# Usage:
+# python tests/bench_import.py [module ...]
+#
+# The default module is the plugin as Zim loads it. It is measured in
+# steps: import of the plugin, creation of the extension of the main
+# window, which happens at the start of Zim, and creation of the widget,
+# which happens when its tab is shown. Modules of Zim which are loaded
+# before any plugin are imported before the measuring. Modules of the
+# plugin without Zim can be given as pdfnotes.layout etc.
+#
+
+import os
+import sys
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# number of measurings of each module
+RUNS = 10
+
+# modules of the plugin loaded by Zim
+PLUGIN = 'zim.plugins.pdfnotes'
+
+# modules loaded by Zim before the plugin
+ZIM_MODULES = ('zim.plugins', 'zim.gui.widgets', 'zim.gui.pageview')
+
+# modules, which should be imported only with the widget
+HEAVY_MODULES = ('cairo', 'gio', 'poppler', 'numpy', 'multiprocessing', 'mmap')
+
+# steps of start of the plugin in Zim
+PLUGIN_STEPS = (
+    ('import', 'plugin = __import__(%(module)r, fromlist=["PDFNotesPlugin"])'),
+    ('extension', 'extension = plugin.MainWindowExtension(plugin.PDFNotesPlugin(), BenchWindow())'),
+    ('widget', 'extension.create_widget()'),
+)
+
+CHILD = '''
+import sys
+import time
+import __builtin__
+
+sys.path.insert(0, %(root)r)
+
+# the plugin as package without Zim
+if not %(zim)r :
+    __builtin__.__dict__.setdefault('_', lambda text: text)
+    import tests
+
+for name in %(preload)r :
+    __import__(name)
+
+if %(zim)r :
+    import gtk
+
+    class BenchWindow(gtk.Window):
+
+        # main window with tabs, which are not shown
+        def __init__(self):
+            gtk.Window.__init__(self)
+            self.pageview = gtk.TextView()
+            self.ui = None
+
+        def add_tab(self, key, widget, pane):
+            pass
+
+        def remove(self, widget):
+            pass
+
+for name, code in %(steps)r :
+
+    before = set(name for name in sys.modules if sys.modules[name] != None)
+    start = time.time()
+
+    exec code
+
+    duration = (time.time() - start) * 1000
+    modules = sorted(name for name in sys.modules if sys.modules[name] != None and name not in before)
+
+    print '%%s\\t%%s\\t%%s' %% (name, duration, ' '.join(modules))
+'''
+
+def measure(module):
+    '''
+    Returns list of steps with their duration and loaded modules.
+    '''
+    zim = module.startswith('zim.')
+
+    if module == PLUGIN :
+        steps = [(name, code % {'module': module}) for name, code in PLUGIN_STEPS]
+    else :
+        steps = [('import', '__import__(%r)' % module)]
+
+    code = CHILD % {'root': ROOT, 'zim': zim, 'steps': steps,
+                    'preload': ZIM_MODULES if zim else ()}
+
+    output = subprocess.check_output([sys.executable, '-c', code])
+    results = list()
+
+    for line in output.splitlines():
+        name, duration, modules = line.split('\t')
+        results.append((name, float(duration), modules.split()))
+
+    return results
+
+def main(args):
+
+    for module in args or [PLUGIN] :
+
+        runs = [measure(module) for i in range(RUNS)]
+        print '%s:' % module
+
+        for step in range(len(runs[0])):
+
+            name, duration, modules = runs[0][step]
+            durations = sorted(run[step][1] for run in runs)
+
+            # modules of the plugin and heavy modules
+            plugin = sorted(name.split('.')[-1] for name in modules
+                            if name.startswith(PLUGIN + '.') or name.startswith('pdfnotes.'))
+            heavy = sorted(name for name in modules if name in HEAVY_MODULES)
+
+            print '  %s: median %.1f ms, min %.1f ms, %i modules loaded' % (
+                name, durations[len(durations) // 2], durations[0], len(modules))
+            print '    plugin modules: %s' % (' '.join(plugin) or '-')
+            print '    heavy modules: %s' % (' '.join(heavy) or '-')
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
+
+# end of file tests/bench_import.py
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+
+# Author: Vendula Poncova <poncovka@gmail.com>
+# File: tests/bench_layout.py
+#
+# Description:
+# Measures latency of queries of layout of a dense page with numpy
+# and in pure Python.
+#
+# Usage:
+# python tests/bench_layout.py [queries]
+#
+
+import os
+import sys
+import time
+import random
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import tests
+
+from pdfnotes import layout
+from pdfnotes.layout import PageLayout
+
+# number of queries of each kind
+QUERIES = 300
+
+# size in pt of page
+PAGE_WIDTH, PAGE_HEIGHT = 595, 842
+
+# two columns of 60 lines of 18 words
+COLUMNS, LINES, WORDS = 2, 60, 18
+
+class NoNumpy(object):
+
+    def is_available(self):
+        return False
+
+def generate_layout():
+
+    words = random.Random(0)
+    column_width = (PAGE_WIDTH - 100) / COLUMNS - 10
+    lines = list()
+
+    for column in range(COLUMNS):
+        x = 50 + column * (column_width + 20)
+
+        for line in range(LINES):
+            y = 60 + line * 12
+            width = column_width / WORDS
+
+            lines.append([(u'w%i' % words.randint(0, 1000), (x + i * width, y, x + (i + 1) * width - 2, y + 10))
+                          for i in range(WORDS)])
+
+    return PageLayout.from_words(lines, PAGE_WIDTH, PAGE_HEIGHT)
+
+def generate_queries(count):
+
+    queries = random.Random(1)
+    points, areas = list(), list()
+
+    for i in range(count):
+        points.append((queries.uniform(0, PAGE_WIDTH), queries.uniform(0, PAGE_HEIGHT)))
+
+        # selections of a few lines
+        x, y = queries.uniform(0, PAGE_WIDTH - 200), queries.uniform(0, PAGE_HEIGHT - 100)
+        areas.append((x, y, x + queries.uniform(20, 200), y + queries.uniform(5, 100)))
+
+    return points, areas
+
+def measure(page, points, areas):
+
+    times = dict()
+    results = list()
+
+    start = time.time()
+    results.extend(page.find_line_at(x, y) for x, y in points)
+    times['point'] = (time.time() - start) * 1000 / len(points)
+
+    start = time.time()
+    results.extend(page.find_text(*area) for area in areas)
+    times['rectangle'] = (time.time() - start) * 1000 / len(areas)
+
+    return times, results
+
+def main(args):
+
+    count = int(args[0]) if args else QUERIES
+
+    page = generate_layout()
+    points, areas = generate_queries(count)
+
+    # the first queries import numpy
+    if layout.numpy.is_available() :
+        page.find_text(*areas[0])
+        numpy_times, numpy_results = measure(page, points, areas)
+    else :
+        numpy_times, numpy_results = None, None
+
+    original = layout.numpy
+    layout.numpy = NoNumpy()
+
+    try:
+        python_times, python_results = measure(page, points, areas)
+    finally:
+        layout.numpy = original
+
+    print 'Python %s, %i words, mean of %i queries' % (sys.version.split()[0], len(page.word_x1), count)
+    print '%-10s %10s %10s' % ('query', 'numpy ms', 'python ms')
+
+    for kind in ('point', 'rectangle') :
+        print '%-10s %10s %10.3f' % (kind, '%.3f' % numpy_times[kind] if numpy_times else '-', python_times[kind])
+
+    # both ways give the same results
+    if numpy_results != None and numpy_results != python_results :
+        print 'results differ'
+        return 1
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
+
+# end of file tests/bench_layout.py
@@ -0,0 +1,288 @@
+# -*- coding: utf-8 -*-
+
+# Author: Vendula Poncova <poncovka@gmail.com>
+# File: tests/test_export.py
+#
+# Description:
+# Tests of export of rendered images.
+#
+
+import sys
+import imp
+import zlib
+import struct
+import resource
+import unittest
+
+# the export needs only surfaces of cairo, which are replaced below
+for name in ('gtk', 'cairo') :
+    try:
+        imp.find_module(name)
+    except ImportError:
+        sys.modules.setdefault(name, imp.new_module(name))
+
+from pdfnotes import export
+
+# size of the exported region in px
+REGION_SIZE = 10000
+
+# max size of band in bytes
+MAX_BAND_SIZE = 4 * 1024 * 1024
+
+# max growth of memory of the process in kB
+MAX_MEMORY = 64 * 1024
+
+class StubSurface(object):
+    '''
+    Image surface in format RGB24, which remembers the size
+    of the largest surface created.
+    '''
+    max_size = 0
+
+    def __init__(self, format, width, height):
+
+        self.width = width
+        self.height = height
+        self.data = bytearray(width * 4 * height)
+
+        StubSurface.max_size = max(StubSurface.max_size, len(self.data))
+
+    def flush(self):
+        pass
+
+    def get_width(self):
+        return self.width
+
+    def get_height(self):
+        return self.height
+
+    def get_data(self):
+        return self.data
+
+    def get_stride(self):
+        return self.width * 4
+
+class StubContext(object):
+    '''
+    Context, which fills rectangles with translation and clipping.
+    '''
+    def __init__(self, surface):
+
+        self.surface = surface
+        self.pixel = '\x00' * 4
+        self.dx, self.dy = 0, 0
+        self.path = list()
+
+    def set_source_rgb(self, r, g, b):
+
+        r, g, b = [int(round(value * 255)) for value in (r, g, b)]
+
+        # 32-bit integers in the native byte order
+        if sys.byteorder == 'little' :
+            self.pixel = struct.pack('BBBB', b, g, r, 0)
+        else :
+            self.pixel = struct.pack('BBBB', 0, r, g, b)
+
+    def translate(self, dx, dy):
+
+        self.dx += dx
+        self.dy += dy
+
+    def clip_extents(self):
+
+        return -self.dx, -self.dy, self.surface.width - self.dx, self.surface.height - self.dy
+
+    def rectangle(self, x, y, width, height):
+
+        self.path.append((x, y, width, height))
+
+    def paint(self):
+
+        self.path = [self.clip_extents()[:2] + (self.surface.width, self.surface.height)]
+        self.fill()
+
+    def fill(self):
+
+        surface = self.surface
+
+        for x, y, width, height in self.path :
+
+            # device coordinates clipped to the surface
+            x1, x2 = max(0, x + self.dx), min(surface.width, x + width + self.dx)
+            y1, y2 = max(0, y + self.dy), min(surface.height, y + height + self.dy)
+
+            for row in range(y1, y2):
+                start = row * surface.width * 4
+                surface.data[start + x1 * 4:start + x2 * 4] = self.pixel * (x2 - x1)
+
+        self.path = list()
+
+class NoNumpy(object):
+
+    def is_available(self):
+        return False
+
+class StubCairo(object):
+
+    FORMAT_RGB24 = 1
+    ImageSurface = StubSurface
+    Context = StubContext
+
+def get_color(y, right):
+
+    # colors of left and right half of row
+    return (y % 256, (y // 256) % 256, 255 if right else 0)
+
+def render_rows(context, width):
+
+    # draw only the rows in the band
+    x1, y1, x2, y2 = context.clip_extents()
+
+    for y in range(max(0, int(y1)), int(y2)):
+        for right in (False, True) :
+            context.set_source_rgb(*[value / 255.0 for value in get_color(y, right)])
+            context.rectangle(width // 2 if right else 0, y, width - width // 2 if right else width // 2, 1)
+            context.fill()
+
+class PNGChecker(object):
+    '''
+    File, which parses PNG while it is written and checks chunks
+    and rows without keeping them in memory.
+    '''
+    def __init__(self, test, width, height):
+
+        self.test = test
+        self.width = width
+        self.height = height
+        self.buffer = ''
+        self.pixels = ''
+        self.decompressor = zlib.decompressobj()
+        self.signature = False
+        self.kinds = list()
+        self.rows = 0
+
+    def write(self, data):
+
+        self.buffer += data
+
+        if not self.signature and len(self.buffer) >= 8 :
+            self.test.assertEqual(self.buffer[:8], '\x89PNG\r\n\x1a\n')
+            self.buffer = self.buffer[8:]
+            self.signature = True
+
+        # complete chunks
+        while self.signature and len(self.buffer) >= 12 :
+
+            length = struct.unpack('>I', self.buffer[:4])[0]
+
+            if len(self.buffer) < length + 12 :
+                break
+
+            kind = self.buffer[4:8]
+            data = self.buffer[8:8 + length]
+            crc = struct.unpack('>I', self.buffer[8 + length:12 + length])[0]
+            self.buffer = self.buffer[12 + length:]
+
+            self.test.assertEqual(crc, zlib.crc32(kind + data) & 0xffffffff)
+            self.on_chunk(kind, data)
+
+    def on_chunk(self, kind, data):
+
+        if not self.kinds or self.kinds[-1] != kind :
+            self.kinds.append(kind)
+
+        if kind == 'IHDR' :
+            self.test.assertEqual(struct.unpack('>IIBBBBB', data), (self.width, self.height, 8, 2, 0, 0, 0))
+
+        elif kind == 'IDAT' :
+            self.pixels += self.decompressor.decompress(data)
+            self.check_rows()
+
+    def check_rows(self):
+
+        size = 1 + self.width * 3
+        half = self.width // 2
+
+        start = 0
+
+        while len(self.pixels) - start >= size :
+
+            row = self.pixels[start:start + size]
+            start += size
+
+            # no filter, left and right half in RGB
+            left = struct.pack('BBB', *get_color(self.rows, False))
+            right = struct.pack('BBB', *get_color(self.rows, True))
+
+            self.test.assertEqual(row, '\x00' + left * half + right * (self.width - half))
+            self.rows += 1
+
+        self.pixels = self.pixels[start:]
+
+class TestExport(unittest.TestCase):
+
+    def setUp(self):
+
+        self.cairo = export.cairo
+        export.cairo = StubCairo
+        StubSurface.max_size = 0
+
+    def tearDown(self):
+
+        export.cairo = self.cairo
+
+    def export(self, width, height, max_size):
+
+        f = PNGChecker(self, width, height)
+        export.write_png_in_bands(f, width, height, max_size, lambda context: render_rows(context, width))
+
+        self.assertEqual(f.buffer, '')
+        self.assertEqual(f.kinds, ['IHDR', 'IDAT', 'IEND'])
+        self.assertEqual(f.rows, height)
+        self.assertEqual(f.pixels + f.decompressor.flush(), '')
+
+    def test_small(self):
+
+        # bands do not divide the height
+        self.export(7, 10, 7 * 4 * 3)
+        self.assertEqual(StubSurface.max_size, 7 * 4 * 3)
+
+    def test_narrow_band(self):
+
+        # at least one row
+        self.export(50, 3, 10)
+        self.assertEqual(StubSurface.max_size, 50 * 4)
+
+    def test_surface_to_rgb(self):
+
+        surface = StubSurface(StubCairo.FORMAT_RGB24, 9, 5)
+        render_rows(StubContext(surface), 9)
+
+        rows = ''.join('%s%s' % (struct.pack('BBB', *get_color(y, False)) * 4,
+                                 struct.pack('BBB', *get_color(y, True)) * 5) for y in range(5))
+
+        self.assertEqual(export.surface_to_rgb(surface), rows)
+
+        # the same without numpy
+        original = export.numpy
+        export.numpy = NoNumpy()
+
+        try:
+            self.assertEqual(export.surface_to_rgb(surface), rows)
+        finally:
+            export.numpy = original
+
+    def test_large_region(self):
+
+        before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        self.export(REGION_SIZE, REGION_SIZE, MAX_BAND_SIZE)
+
+        # only one band is in memory
+        self.assertLessEqual(StubSurface.max_size, MAX_BAND_SIZE)
+        self.assertLess(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before, MAX_MEMORY)
+
+if __name__ == '__main__':
+    unittest.main()
+
+# end of file tests/test_export.py
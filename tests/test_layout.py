@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+
+# Author: Vendula Poncova <poncovka@gmail.com>
+# File: tests/test_layout.py
+#
+# Description:
+# Tests of layout of text on PDF page.
+#
+
+import unittest
+
+from pdfnotes import layout
+from pdfnotes.layout import PageLayout
+
+class NoNumpy(object):
+
+    def is_available(self):
+        return False
+
+def chars_layout(text, size=5, line_height=12):
+
+    # rects of chars of monospace text
+    rects = list()
+    x, y = 0, 0
+
+    for char in text.decode('utf-8') if isinstance(text, str) else text:
+        rects.append((x, y, x + size, y + line_height - 2))
+
+        if char == u'\n':
+            x, y = 0, y + line_height
+        else :
+            x += size
+
+    return PageLayout.from_chars(text, rects, 600, 800)
+
+class TestLayout(unittest.TestCase):
+
+    def test_ascii(self):
+
+        page = chars_layout(u'first line\nsecond line')
+
+        self.assertEqual(page.find_line(2, 2)[0], u'first line')
+        self.assertEqual(page.find_text(0, 0, 600, 800)[0], u'first line second line')
+
+    def test_non_ascii_unicode(self):
+
+        page = chars_layout(u'café au lait\nnaïve “quotes” – ﬁn')
+
+        self.assertEqual(page.find_line(2, 2)[0], u'café au lait')
+        self.assertEqual(page.find_line(2, 14)[0], u'naïve “quotes” – ﬁn')
+
+        # the word after accented chars starts at its rect
+        text, areas = page.find_text(5 * 5 + 1, 2, 5 * 6, 4)
+        self.assertEqual(text, u'au')
+        self.assertEqual(areas[0][0], 5 * 5)
+
+    def test_non_ascii_bytes(self):
+
+        # poppler returns UTF-8
+        page = chars_layout('café au lait')
+        self.assertEqual(page.find_line(2, 2)[0], u'café au lait')
+
+        lines = PageLayout.from_lines([('café au lait', (10, 10, 100, 20))], 600, 800)
+        self.assertEqual(lines.find_line(20, 15)[0], u'café au lait')
+
+        words = PageLayout.from_words([[('café', (10, 10, 40, 20)), (u'lait', (45, 10, 70, 20))]], 600, 800)
+        self.assertEqual(words.find_line(20, 15)[0], u'café lait')
+
+    def test_hyphenated_paragraph(self):
+
+        page = chars_layout(u'a long hyph-\nenated word')
+        self.assertEqual(page.find_paragraph(2, 2)[0], u'a long hyphenated word')
+
+    def test_without_numpy(self):
+
+        text = u'one two three\nfour five six\nseven eight'
+        page = chars_layout(text)
+        found = page.find_text(30, 0, 60, 20), page.find_line_at(2, 14)
+
+        original = layout.numpy
+        layout.numpy = NoNumpy()
+
+        try:
+            self.assertEqual((page.find_text(30, 0, 60, 20), page.find_line_at(2, 14)), found)
+        finally:
+            layout.numpy = original
+
+    def test_table(self):
+
+        rows = [(u'Name', u'Price'), (u'Crème brûlée', u'4.50'), (u'Tea', u'1.20')]
+        lines = list()
+
+        for r, row in enumerate(rows):
+            words = list()
+
+            for c, cell in enumerate(row):
+                x = 50 + c * 150
+
+                for word in cell.split():
+                    words.append((word, (x, 100 + r * 14, x + len(word) * 5, 110 + r * 14)))
+                    x += len(word) * 5 + 3
+
+            lines.append(words)
+
+        page = PageLayout.from_words(lines, 600, 800)
+        table, areas = page.find_table(0, 0, 600, 800)
+
+        self.assertEqual(table, [list(row) for row in rows])
+        self.assertEqual(len(areas), 6)
+
+if __name__ == '__main__':
+    unittest.main()
+
+# end of file tests/test_layout.py
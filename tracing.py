@@ -0,0 +1,363 @@
+# -*- coding: utf-8 -*-
+
+# Author: Vendula Poncova <poncovka@gmail.com>
+# File: tracing.py
+#
+# Description:
+# Recording of interaction with PDF Notes widget and its replay
+# for measuring of latency.
+#
+# Usage:
+# PDFNOTES_TRACE=trace.json zim                          record a trace
+# python -m zim.plugins.pdfnotes.tracing [trace] [pdf]   replay a trace
+#
+# Replay needs a display, use xvfb-run on a headless machine. Without
+# the trace, a generated one is replayed on a generated document.
+#
+
+import os
+import sys
+import gtk
+import json
+import time
+import random
+import shutil
+import logging
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+# file for recording of trace, recording is off if not set
+TRACE_VARIABLE = 'PDFNOTES_TRACE'
+
+# duration of one frame in ms
+FRAME_TIME = 1000 / 60.0
+
+# size in pt of generated pages
+PAGE_WIDTH, PAGE_HEIGHT = 595, 842
+
+WORDS = (u'lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod '
+         u'tempor incididunt ut labore et dolore magna aliqua enim ad minim veniam').split()
+
+def get_trace_path():
+
+    return os.environ.get(TRACE_VARIABLE)
+
+class TraceRecorder(object):
+    '''
+    Writes events of widget with their time, page and settings
+    to file as JSON lines.
+    '''
+    def __init__(self, path):
+
+        self.file = open(path, 'a')
+        self.start = time.time()
+
+        logger.info('PDF Notes: recording trace to %s', path)
+
+    def record(self, kind, event, widget):
+
+        item = {
+            'time'  : round(time.time() - self.start, 4),
+            'kind'  : kind,
+            'file'  : widget.document.file.path if widget.document.exists() else None,
+            'page'  : widget.document.page_number,
+            'zoom'  : widget.zoom_button.get_active_text(),
+            'style' : widget.selection_style,
+            'keys'  : sorted(widget.keys),
+        }
+
+        # position, button and direction of event
+        if event != None :
+            for name in ('x', 'y', 'button') :
+                if hasattr(event, name) :
+                    item[name] = getattr(event, name)
+
+            if hasattr(event, 'direction') :
+                item['direction'] = event.direction.value_nick
+
+        self.file.write(json.dumps(item) + '\n')
+
+    def close(self):
+
+        self.file.close()
+
+def load_trace(path):
+
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def generate_pdf(path, pages=20):
+    '''
+    Writes document with two columns of text and a figure on each page.
+    '''
+    import cairo
+
+    surface = cairo.PDFSurface(path, PAGE_WIDTH, PAGE_HEIGHT)
+    context = cairo.Context(surface)
+    context.set_font_size(10)
+    words = random.Random(0)
+
+    for page in range(pages):
+
+        # figure
+        context.set_source_rgb(0.6, 0.7, 0.9)
+        context.rectangle(50, 60, PAGE_WIDTH - 100, 150)
+        context.fill()
+
+        # columns of text
+        context.set_source_rgb(0, 0, 0)
+
+        for column in (50, PAGE_WIDTH / 2 + 10) :
+            for y in range(240, PAGE_HEIGHT - 50, 13) :
+                context.move_to(column, y)
+                context.show_text(u' '.join(words.choice(WORDS) for i in range(6)).encode('utf-8'))
+
+        context.show_page()
+
+    surface.finish()
+
+def generate_trace(pages=20):
+    '''
+    Returns trace of typical reading: hovering lines and paragraphs,
+    selecting text and images, scrolling through pages and zooming.
+    '''
+    from .gui import PDFNotesWidget as W
+
+    events = list()
+    state = {'time': 0.0, 'page': 0, 'zoom': W.ZOOM_FIT, 'style': W.SELECT_LINE, 'keys': []}
+
+    def add(kind, delay=FRAME_TIME / 1000, **data):
+        state['time'] += delay
+        item = dict(state, kind=kind)
+        item.update(data)
+        events.append(item)
+
+    for page in range(min(pages, 5)):
+        state['page'] = page
+
+        # hover lines and paragraphs
+        for style in (W.SELECT_LINE, W.SELECT_PARAGRAPH) :
+            state['style'] = style
+
+            for i in range(60):
+                add('motion', x=60 + 4 * i, y=240 + 8 * i)
+
+        # drag over text and image
+        for style, y in ((W.SELECT_LINE, 300), (W.SELECT_IMAGE, 60)) :
+            state['style'] = style
+            add('press', x=60, y=y, button=1)
+
+            for i in range(30):
+                add('motion', x=60 + 8 * i, y=y + 4 * i)
+
+            add('release', x=300, y=y + 120, button=1, delay=0.1)
+
+        # scroll to the next page
+        for i in range(10):
+            add('scroll', direction='down')
+
+    # zoom in and out by scrolling
+    state['keys'] = ['Control_L']
+
+    for direction in ('up',) * 5 + ('down',) * 5 :
+        add('scroll', direction=direction, delay=0.05)
+
+    state['keys'] = []
+
+    # zoom from toolbar
+    for zoom in ('200%', '60%', W.ZOOM_FIT) :
+        state['zoom'] = zoom
+        add('zoom', delay=0.5)
+
+    return events
+
+class ReplayExtension(object):
+
+    def __init__(self):
+
+        self.uistate = {'last_file': '', 'documents': {}}
+        self.source_links = False
+        self.keep_state = False
+
+class ReplayUI(object):
+
+    def __init__(self, window):
+
+        self.mainwindow = window
+
+class Replayer(object):
+    '''
+    Replays trace on PDF Notes widget in offscreen window and
+    measures the time of handling and drawing of each event.
+    '''
+    def __init__(self, pdf_path, preferences):
+
+        from zim.fs import File
+        from .gui import PDFNotesWidget
+
+        self.latencies = dict()
+        self.stalls = list()
+
+        self.window = gtk.OffscreenWindow()
+        self.window.set_default_size(600, 800)
+
+        self.widget = PDFNotesWidget(ReplayExtension(), ReplayUI(self.window), preferences)
+        self.window.add(self.widget)
+        self.window.show_all()
+
+        # collect selections instead of writing to notebook
+        self.widget.collect_button.set_active(True)
+        self.widget.open_file(File(pdf_path))
+        self.wait(0.5)
+
+        # only the replay is measured
+        self.stalls = list()
+
+    def wait(self, duration):
+
+        end = time.time() + duration
+
+        # run timeouts and idle callbacks, measure their stalls
+        while time.time() < end :
+
+            if gtk.events_pending() :
+                start = time.time()
+                gtk.main_iteration(False)
+                self.stalls.append((time.time() - start) * 1000)
+            else :
+                time.sleep(0.001)
+
+    def replay(self, events):
+
+        previous = None
+
+        for item in events:
+
+            # keep the recorded pace
+            if previous != None :
+                self.wait(max(0, item['time'] - previous))
+
+            previous = item['time']
+
+            start = time.time()
+            self.dispatch(item)
+
+            # draw the result
+            if self.widget.drawing_area.window :
+                self.widget.drawing_area.window.process_updates(True)
+
+            self.latencies.setdefault(item['kind'], list()).append((time.time() - start) * 1000)
+
+        self.wait(0.5)
+
+    def dispatch(self, item):
+
+        widget = self.widget
+        document = widget.document
+
+        # the same page and settings as recorded
+        if item.get('page') != None and item['page'] != document.page_number \
+           and item['page'] < document.pages_count and item['kind'] != 'scroll' :
+            document.set_page(item['page'])
+            widget.update()
+
+        # the style changes during dragging
+        if not widget.drag :
+            widget.selection_style = item.get('style', widget.selection_style)
+
+        widget.keys = set(item.get('keys', ()))
+
+        kind = item['kind']
+
+        if kind == 'zoom' :
+            from zim.gui.widgets import gtk_combobox_set_active_text
+            gtk_combobox_set_active_text(widget.zoom_button, item['zoom'])
+            return
+
+        types = {
+            'motion'  : (gtk.gdk.MOTION_NOTIFY, 'motion-notify-event', widget.drawing_area),
+            'press'   : (gtk.gdk.BUTTON_PRESS, 'button_press_event', widget.drawing_area),
+            'release' : (gtk.gdk.BUTTON_RELEASE, 'button_release_event', widget.drawing_area),
+            'scroll'  : (gtk.gdk.SCROLL, 'scroll-event', widget.scrolled_w),
+        }
+
+        event_type, signal, target = types[kind]
+
+        event = gtk.gdk.Event(event_type)
+        event.window = target.window
+        event.time = int(time.time() * 1000) & 0xffffffff
+
+        if kind == 'scroll' :
+            directions = dict((d.value_nick, d) for d in (gtk.gdk.SCROLL_UP, gtk.gdk.SCROLL_DOWN,
+                                                          gtk.gdk.SCROLL_LEFT, gtk.gdk.SCROLL_RIGHT))
+            event.direction = directions[item['direction']]
+        else :
+            event.x, event.y = float(item['x']), float(item['y'])
+
+        if kind in ('press', 'release') :
+            event.button = item.get('button', 1)
+
+        target.emit(signal, event)
+
+    def report(self):
+
+        lines = ['%-10s %6s %8s %8s %8s %8s %8s' % ('event', 'count', 'p50 ms', 'p90 ms', 'p99 ms', 'max ms', 'dropped')]
+
+        for kind, values in sorted(self.latencies.items()) + [('background', self.stalls)] :
+
+            if not values :
+                continue
+
+            values = sorted(values)
+            dropped = sum(int(value // FRAME_TIME) for value in values)
+
+            lines.append('%-10s %6i %8.1f %8.1f %8.1f %8.1f %8i' % (
+                kind, len(values), percentile(values, 50), percentile(values, 90),
+                percentile(values, 99), values[-1], dropped))
+
+        return '\n'.join(lines)
+
+def percentile(values, p):
+
+    # values are sorted
+    index = int(round((len(values) - 1) * p / 100.0))
+    return values[index]
+
+def main(args):
+
+    from zim.fs import Dir
+    from . import PDFNotesPlugin, cache
+
+    # files cached during the replay do not mix with the cache of the user
+    cache_dir = tempfile.mkdtemp(prefix='pdfnotes-cache-')
+    os.environ['XDG_CACHE_HOME'] = cache_dir
+    cache.XDG_CACHE_HOME = Dir(cache_dir)
+
+    trace = load_trace(args[0]) if args else None
+    pdf_path = args[1] if len(args) > 1 else None
+
+    # generated document and trace
+    if pdf_path == None :
+        fd, pdf_path = tempfile.mkstemp(prefix='pdfnotes-', suffix='.pdf')
+        os.close(fd)
+        generate_pdf(pdf_path)
+
+    if trace == None :
+        trace = generate_trace()
+
+    # default preferences of plugin
+    preferences = dict((p[0], p[3]) for p in PDFNotesPlugin.plugin_preferences)
+
+    replayer = Replayer(os.path.abspath(pdf_path), preferences)
+    replayer.replay(trace)
+    replayer.widget.on_destroy()
+
+    shutil.rmtree(cache_dir, ignore_errors=True)
+
+    print replayer.report()
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
+
+# end of file tracing.py